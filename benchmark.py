@@ -0,0 +1,273 @@
+# -*- coding: UTF-8 -*-
+"""
+Search latency benchmark, can only be used when Kupfer is run from the
+Source directory.
+
+Build a synthetic catalog and a register of learned mnemonics, replay
+typing sessions through Searcher.search and report the latency of each
+keystroke, the time to load the catalog and the peak memory, as one
+line of JSON per catalog size:
+
+	python benchmark.py --leaves 10000,100000,1000000 --output bench.jsonl
+
+Each catalog size is measured in a separate process, so that its peak
+memory is its own. Typing sessions can be recorded in a file with one
+JSON list of keys per line, for example ["f", "fi", "fir", "fi", "fix"];
+by default they are generated from the catalog.
+"""
+
+from __future__ import with_statement
+
+import gc
+import gettext
+import itertools
+import json
+import optparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+gettext.install("kupfer", unicode=True, names=("ngettext",))
+
+from kupfer.core import data, learn
+from kupfer.obj.base import Leaf, Source
+from kupfer.obj.sources import MultiSource
+
+# Number of matches a search result shows at first
+SHOW_MATCHES = 10
+
+_SYLLABLES = (u"ka ru mi to na se fi re fox ter mi nal do cu ment pho to "
+              u"mu sic play er ar chi ve re port draft ba ck up lo g ed it "
+              u"gno me py th on kup fer win dow ma il").split()
+_ACCENTED = {u"a": u"á", u"e": u"é", u"o": u"ö", u"u": u"ü", u"n": u"ñ",
+             u"c": u"ç", u"s": u"ß"}
+_EXTENSIONS = (u".txt", u".pdf", u".png", u".py", u".ogg", u".tar.gz")
+
+class BenchLeaf (Leaf):
+	pass
+
+class BenchSource (Source):
+	def __init__(self, name, leaves):
+		Source.__init__(self, name)
+		self.leaves = leaves
+
+	def repr_key(self):
+		return self.name
+
+	def get_items(self):
+		return iter(self.leaves)
+
+def _zipf_choice(rnd, seq, exponent=1.2):
+	"""Choose from @seq, with the first items much more likely"""
+	idx = int(rnd.paretovariate(exponent)) - 1
+	return seq[idx % len(seq)]
+
+def make_words(rnd, count):
+	"""Return @count distinct words, some of them with non-ASCII letters"""
+	words = set()
+	while len(words) < count:
+		word = u"".join(rnd.choice(_SYLLABLES)
+		                for _ in xrange(rnd.randint(1, 4)))
+		if rnd.random() < 0.1:
+			word = u"".join(_ACCENTED.get(c, c) for c in word)
+		words.add(word)
+	return sorted(words)
+
+def make_name(rnd, words):
+	"""Return a name like those of applications, files and contacts"""
+	nwords = rnd.choice((1, 1, 2, 2, 2, 3, 3, 4))
+	parts = [_zipf_choice(rnd, words) for _ in xrange(nwords)]
+	kind = rnd.random()
+	if kind < 0.4:
+		name = rnd.choice((u"-", u"_", u" ")).join(parts)
+		if rnd.random() < 0.5:
+			name += u"%d" % rnd.randint(1, 2011)
+		return name + rnd.choice(_EXTENSIONS)
+	if kind < 0.6:
+		return u" ".join(p.capitalize() for p in parts)
+	return u" ".join(parts)
+
+def make_catalog(nleaves, seed=0, aliases=0.1):
+	"""Return a MultiSource of sources with @nleaves leaves in total
+
+	A fraction @aliases of the leaves have an alias, as applications do.
+	"""
+	rnd = random.Random(seed)
+	words = make_words(rnd, max(100, int(nleaves ** 0.5)))
+	# a few large sources, like deep directories, and many small ones
+	sizes = []
+	remaining = nleaves
+	for fraction in (0.5, 0.2, 0.1):
+		sizes.append(int(nleaves * fraction))
+		remaining -= sizes[-1]
+	while remaining > 0:
+		size = min(remaining, rnd.randint(10, 500))
+		sizes.append(size)
+		remaining -= size
+	sources = []
+	counter = itertools.count()
+	for snum, size in enumerate(sizes):
+		leaves = []
+		for _ in xrange(size):
+			num = counter.next()
+			leaf = BenchLeaf(num, make_name(rnd, words))
+			if rnd.random() < aliases:
+				leaf.kupfer_add_alias(make_name(rnd, words))
+			leaves.append(leaf)
+		sources.append(BenchSource(u"Source %d" % snum, leaves))
+	return MultiSource(sources)
+
+def abbreviation(rnd, name, length):
+	"""Return a query of @length for @name: a prefix, or word initials"""
+	name = name.lower()
+	if rnd.random() < 0.3:
+		initials = u"".join(w[0] for w in name.split() if w)
+		if len(initials) >= length:
+			return initials[:length]
+	return name[:length]
+
+def make_sessions(rnd, leaves, count):
+	"""Return @count typing sessions, each a list of successive queries,
+	searching for leaves of @leaves with some typos and corrections
+	"""
+	sessions = []
+	for _ in xrange(count):
+		leaf = _zipf_choice(rnd, leaves)
+		query = abbreviation(rnd, unicode(leaf), rnd.randint(2, 8))
+		keys = []
+		for end in xrange(1, len(query) + 1):
+			keys.append(query[:end])
+			if rnd.random() < 0.05:
+				keys.append(query[:end] + rnd.choice(u"xqz"))
+				keys.append(query[:end])
+		sessions.append(keys)
+	return sessions
+
+def read_sessions(filename):
+	with open(filename, "r") as infile:
+		return [[unicode(k) for k in json.loads(line)]
+		        for line in infile if line.strip()]
+
+def make_register(rnd, leaves, count):
+	"""Record @count search hits for leaves of @leaves"""
+	for _ in xrange(count):
+		leaf = _zipf_choice(rnd, leaves)
+		key = abbreviation(rnd, unicode(leaf), rnd.randint(0, 4))
+		learn.record_search_hit(leaf, key)
+
+def percentile(sorted_values, pct):
+	"""Return the @pct percentile of @sorted_values (nearest rank)"""
+	if not sorted_values:
+		return None
+	rank = int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1
+	return sorted_values[max(0, min(rank, len(sorted_values) - 1))]
+
+def replay(root, sessions):
+	"""Replay @sessions through a Searcher, as a pane does, and return
+	the latency of each keystroke in seconds
+	"""
+	latencies = []
+	for keys in sessions:
+		searcher = data.Searcher()
+		for key in keys:
+			start = time.time()
+			match, match_iter = searcher.search([root], key)
+			for _ in itertools.islice(match_iter, SHOW_MATCHES):
+				pass
+			latencies.append(time.time() - start)
+	return latencies
+
+def run_benchmark(nleaves, nsessions=200, nrecords=None, seed=0,
+		sessions_file=None):
+	"""Run the benchmark for @nleaves leaves and return the results"""
+	rnd = random.Random(seed)
+	start = time.time()
+	root = make_catalog(nleaves, seed)
+	leaves = [leaf for src in root.sources for leaf in src.get_leaves()]
+	make_register(rnd, leaves, nrecords or nleaves // 10)
+	catalog_time = time.time() - start
+	if sessions_file:
+		sessions = read_sessions(sessions_file)
+	else:
+		sessions = make_sessions(rnd, leaves, nsessions)
+	gc.collect()
+	objects_before = len(gc.get_objects())
+
+	# the first search indexes the catalog
+	start = time.time()
+	replay(root, [[u"a"]])
+	index_time = time.time() - start
+
+	latencies = sorted(replay(root, sessions))
+	gc.collect()
+	def ms(seconds):
+		return round(seconds * 1000, 3)
+	return {
+		"leaves": nleaves,
+		"sources": len(root.sources),
+		"sessions": len(sessions),
+		"keystrokes": len(latencies),
+		"catalog_s": round(catalog_time, 3),
+		"index_ms": ms(index_time),
+		"latency_ms": {
+			"mean": ms(sum(latencies) / max(len(latencies), 1)),
+			"p50": ms(percentile(latencies, 50) or 0),
+			"p95": ms(percentile(latencies, 95) or 0),
+			"p99": ms(percentile(latencies, 99) or 0),
+			"max": ms(latencies[-1] if latencies else 0),
+		},
+		"peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+		"new_objects": len(gc.get_objects()) - objects_before,
+		"python": sys.version.split()[0],
+		"time": int(time.time()),
+	}
+
+def main():
+	parser = optparse.OptionParser(usage="%prog [options]")
+	parser.add_option("--leaves", default="10000",
+			help="catalog sizes, comma separated [%default]")
+	parser.add_option("--sessions", type="int", default=200,
+			help="number of generated typing sessions [%default]")
+	parser.add_option("--sessions-file",
+			help="replay the typing sessions in this file")
+	parser.add_option("--records", type="int", default=None,
+			help="learned search hits [a tenth of the leaves]")
+	parser.add_option("--seed", type="int", default=0)
+	parser.add_option("--output",
+			help="append the results to this file")
+	parser.add_option("--single", action="store_true",
+			help="measure in this process (used internally)")
+	options, args = parser.parse_args()
+
+	sizes = [int(n) for n in options.leaves.split(",")]
+	if options.single or len(sizes) == 1:
+		lines = []
+		for nleaves in sizes:
+			result = run_benchmark(nleaves, options.sessions, options.records,
+					options.seed, options.sessions_file)
+			lines.append(json.dumps(result, sort_keys=True))
+	else:
+		lines = []
+		for nleaves in sizes:
+			argv = [sys.executable, os.path.abspath(__file__), "--single",
+			        "--leaves=%d" % nleaves,
+			        "--sessions=%d" % options.sessions,
+			        "--seed=%d" % options.seed]
+			if options.records is not None:
+				argv.append("--records=%d" % options.records)
+			if options.sessions_file:
+				argv.append("--sessions-file=%s" % options.sessions_file)
+			output = subprocess.Popen(argv, stdout=subprocess.PIPE).communicate()[0]
+			lines.extend(output.splitlines())
+	for line in lines:
+		print line
+	if options.output:
+		with open(options.output, "a") as outfile:
+			for line in lines:
+				outfile.write(line + "\n")
+
+if __name__ == '__main__':
+	main()
@@ -1,6 +1,8 @@
+import cPickle
+import cStringIO
 import fnmatch
-import io
 import pickle
+import re
 import sys
 
 class universalset (object):
@@ -35,24 +37,71 @@ class ConservativeUnpickler (pickle.Unpickler):
 		"copy_reg" : set(["_reconstructor"]),
 		"kupfer.*" : universalset(),
 	}
+	@classmethod
+	def _get_allowlist(cls):
+		"""Return the allowlist compiled from cls.safe_modules:
+		(safe_modules, exact modules, (match, names) of module patterns,
+		 dict of (module, name) -> verdict)
+		"""
+		allowlist = _allowlists.get(cls)
+		if allowlist is None or allowlist[0] is not cls.safe_modules:
+			exact = {}
+			patterns = []
+			for pattern, names in cls.safe_modules.iteritems():
+				if not any(char in pattern for char in "*?["):
+					exact[pattern] = names
+				else:
+					match = re.compile(fnmatch.translate(pattern)).match
+					patterns.append((match, names))
+			allowlist = (cls.safe_modules, exact, patterns, {})
+			_allowlists[cls] = allowlist
+		return allowlist
+
 	@classmethod
 	def is_safe_symbol(cls, module, name):
-		for pattern in cls.safe_modules:
-			if fnmatch.fnmatchcase(module, pattern):
-				return name in cls.safe_modules[pattern]
-		return False
+		safe_modules, exact, patterns, verdicts = cls._get_allowlist()
+		try:
+			return verdicts[module, name]
+		except KeyError:
+			pass
+		names = exact.get(module)
+		if names is None:
+			for match, pattern_names in patterns:
+				if match(module):
+					names = pattern_names
+					break
+		verdict = names is not None and name in names
+		verdicts[module, name] = verdict
+		return verdict
 
-	def find_class(self, module, name):
+	@classmethod
+	def find_global(cls, module, name):
+		"""Return the global @name of @module, if it is safe"""
 		if module not in sys.modules:
 			raise pickle.UnpicklingError("Refusing to load module %s" % module)
-		if not self.is_safe_symbol(module, name):
+		if not cls.is_safe_symbol(module, name):
 			raise pickle.UnpicklingError("Refusing unsafe %s.%s" % (module, name))
-		return pickle.Unpickler.find_class(self, module, name)
+		return getattr(sys.modules[module], name)
+
+	def find_class(self, module, name):
+		return self.find_global(module, name)
 
 	@classmethod
 	def loads(cls, pickledata):
-		unpickler = cls(io.BytesIO(pickledata))
-		return unpickler.load()
+		"""Unpickle the string @pickledata
+
+		This uses the C unpickler, which looks up all classes and
+		functions through cls.find_global
+		"""
+		unpickler = cPickle.Unpickler(cStringIO.StringIO(pickledata))
+		unpickler.find_global = cls.find_global
+		try:
+			return unpickler.load()
+		except cPickle.UnpicklingError, exc:
+			raise pickle.UnpicklingError(*exc.args)
+
+# class -> compiled safe_modules
+_allowlists = {}
 
 class BasicUnpickler (ConservativeUnpickler):
 	"""An Unpickler that can only unpickle persistend ids and select builtins
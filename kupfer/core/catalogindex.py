@@ -0,0 +1,235 @@
+"""
+Index of the names in cached sources, to find search candidates quickly
+
+A leaf can only match a query if each character of the query occurs in
+its (lowercased) name or in one of its aliases; see
+relevance._findBestMatch. For each source we keep a bitmap (a long) per
+character, with bit i set when leaf i contains the character. The
+intersection of the bitmaps for the characters in a query is a superset
+of the matching leaves, in catalog order, so scoring only the candidates
+gives exactly the same result as scoring all leaves.
+
+The index also remembers the result of the latest queries, so that a
+query can be answered again without scoring, and a query that extends a
+remembered one only needs to rescore its matches.
+
+The index of a source is rebuilt when its ``cached_items`` change. It
+holds the names of the leaves in columns, lowercased and with the word
+separators found once, which the scorer reads from. Leaves restored from
+the catalog snapshot are indexed from its name columns, without loading
+them.
+"""
+
+from __future__ import with_statement
+
+import array
+import collections
+import itertools
+import re
+import threading
+import weakref
+
+from kupfer import datatools
+from kupfer.core import catalogsnapshot
+
+# Number of query results to remember, per source
+QUERY_CACHE_SIZE = 10
+
+# Source -> SourceIndex
+_source_indices = weakref.WeakKeyDictionary()
+
+# Word separators, as in relevance.score
+_SEPARATORS = re.compile(u"[ -]")
+
+def _make_bitmap(positions, length):
+	"""Return a long with the bits in @positions set"""
+	bits = bytearray("0" * length)
+	one = ord("1")
+	for pos in positions:
+		bits[pos] = one
+	bits.reverse()
+	return long(str(bits), 2)
+
+def _bit_positions(bitmap):
+	"""Yield the position of each set bit in @bitmap, lowest first
+
+	>>> list(_bit_positions(0b10110))
+	[1, 2, 4]
+	>>> list(_bit_positions(0))
+	[]
+	"""
+	bits = bin(bitmap)[:1:-1]
+	pos = bits.find("1")
+	while pos != -1:
+		yield pos
+		pos = bits.find("1", pos + 1)
+
+def is_complete(items):
+	"""Return True if @items is a fully computed sequence"""
+	if isinstance(items, (list, tuple, catalogsnapshot.LazyLeaves)):
+		return True
+	return isinstance(items, datatools.SavedIterable) and items.iterator is None
+
+class QueryResult (object):
+	"""
+	The leaves that matched a query: their positions and ranks, and
+	for those that matched on an alias, the alias
+
+	Initialize with an iterable of (position, rank, alias or None)
+	"""
+	__slots__ = ("positions", "ranks", "aliases")
+	def __init__(self, scored):
+		self.positions = array.array("l")
+		self.ranks = array.array("d")
+		self.aliases = {}
+		for pos, rank, alias in scored:
+			self.positions.append(pos)
+			self.ranks.append(rank)
+			if alias is not None:
+				self.aliases[pos] = alias
+
+	def __len__(self):
+		return len(self.positions)
+
+	def __iter__(self):
+		aliases = self.aliases
+		for pos, rank in itertools.izip(self.positions, self.ranks):
+			yield pos, rank, aliases.get(pos)
+
+class SourceIndex (object):
+	"""
+	Character index of the leaves @items of one source
+
+	@items must be a complete sequence; the index is not updated
+	if it changes.
+
+	>>> from kupfer.obj.base import Leaf
+	>>> index = SourceIndex([Leaf(1, u"Firefox"), Leaf(2, u"Terminal")])
+	>>> list(index.candidate_positions(u"fx"))
+	[0]
+	>>> index.get_result(u"fx") is None
+	True
+	>>> index.set_result(u"fx", QueryResult([(0, 90.0, None)]))
+	>>> list(index.refine_positions(u"fxo"))
+	[0]
+	"""
+	def __init__(self, items):
+		self.items = items
+		if isinstance(items, catalogsnapshot.LazyLeaves):
+			self.leaves = items
+			names = itertools.izip(items.get_names(), items.get_aliases())
+		else:
+			self.leaves = list(items)
+			names = ((unicode(leaf), getattr(leaf, "name_aliases", ()))
+			         for leaf in self.leaves)
+		# share equal strings, and use the name itself if already lowercase
+		strings = {}
+		def lower(string):
+			lowered = string.lower()
+			if lowered == string:
+				return string
+			return strings.setdefault(lowered, lowered)
+
+		self.values = values = []
+		self.lowered = lowered = []
+		self.aliases = aliases = []
+		self.lowered_aliases = lowered_aliases = []
+		self.separators = separators = array.array("l")
+		self.separator_starts = separator_starts = array.array("l")
+		positions = collections.defaultdict(list)
+		for idx, (value, leaf_aliases) in enumerate(names):
+			lvalue = lower(value)
+			values.append(value)
+			lowered.append(lvalue)
+			separator_starts.append(len(separators))
+			if u" " in lvalue or u"-" in lvalue:
+				separators.extend([m.start() for m in
+				                   _SEPARATORS.finditer(lvalue)])
+			if leaf_aliases:
+				leaf_aliases = tuple(leaf_aliases)
+				leaf_laliases = tuple([lower(a) for a in leaf_aliases])
+				chars = set(lvalue)
+				for lalias in leaf_laliases:
+					chars.update(lalias)
+			else:
+				leaf_aliases = leaf_laliases = ()
+				chars = frozenset(lvalue)
+			aliases.append(leaf_aliases)
+			lowered_aliases.append(leaf_laliases)
+			for char in chars:
+				positions[char].append(idx)
+		separator_starts.append(len(separators))
+		length = len(self.leaves)
+		self.bitmaps = dict((char, _make_bitmap(pos, length))
+		                    for char, pos in positions.iteritems())
+		# the results are read and remembered by the search worker too
+		self._results = datatools.LruCache(QUERY_CACHE_SIZE)
+		self._results_lock = threading.Lock()
+
+	def __len__(self):
+		return len(self.leaves)
+
+	def get_separators(self, pos):
+		"""Return the word separator indices of the lowercased name
+		of the leaf at @pos"""
+		starts = self.separator_starts
+		return self.separators[starts[pos]:starts[pos + 1]]
+
+	def candidate_positions(self, key):
+		"""Yield the positions of the leaves that may match @key
+
+		@key must be lowercase.
+		"""
+		if not key:
+			return iter(xrange(len(self.leaves)))
+		bitmap = -1
+		for char in set(key):
+			bitmap &= self.bitmaps.get(char, 0)
+			if not bitmap:
+				return iter(())
+		return _bit_positions(bitmap)
+
+	def refine_positions(self, key):
+		"""Return the positions of the leaves that may match @key
+
+		If we have the result for a prefix of @key, only its matches
+		are candidates. @key must be lowercase.
+		"""
+		for end in xrange(len(key) - 1, 0, -1):
+			result = self.get_result(key[:end])
+			if result is not None:
+				return result.positions
+		return self.candidate_positions(key)
+
+	def get_result(self, key):
+		"""Return the remembered QueryResult for @key, or None"""
+		with self._results_lock:
+			try:
+				return self._results[key]
+			except KeyError:
+				return None
+
+	def set_result(self, key, result):
+		"""Remember the QueryResult @result for @key"""
+		with self._results_lock:
+			self._results[key] = result
+
+def get_index(source, items):
+	"""Return the SourceIndex for @source, which has the leaves @items
+
+	Return None if @items are not the source's complete and cached
+	leaves, since then we can't index them.
+
+	This must be called in the main thread; see Searcher.snapshot
+	"""
+	if items is not source.cached_items or not is_complete(items):
+		return None
+	index = _source_indices.get(source)
+	if index is None or index.items is not items:
+		index = SourceIndex(items)
+		_source_indices[source] = index
+	return index
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
@@ -0,0 +1,478 @@
+"""
+The catalog snapshot: the cached sources and their leaves, in one file
+
+The snapshot has one section per source. A section holds the pickled
+source, and the source's cached leaves in columns: their names, their
+aliases, their ids, their types and each leaf pickled on its own. The file is
+memory-mapped when read, and a leaf is unpickled only when it is
+accessed, except for leaves of types that validate themselves when
+unpickled (that define __setstate__), which are unpickled when the
+source is loaded. The search index can be built from the name columns,
+and leaves can be found by id, without unpickling any leaf.
+
+File layout, integers are little-endian:
+
+	magic (8 bytes), version (uint32), offset of the index (uint64)
+	the sections
+	the index: number of sections (uint32), and for each section:
+	key (16 bytes), offset (uint64), length (uint64), fingerprint (16 bytes)
+
+The fingerprint of a section is a digest of its data, so that a source
+whose section would be written unchanged does not have to be stored
+again. Changed sections are appended to the file, followed by a new
+index, and the header is updated last; the replaced sections remain in
+the file until it is compacted, that is written anew.
+
+A section is a sequence of blobs, each preceded by its length (uint32):
+
+	source pickle, types pickle, type numbers,
+	names, name offsets, aliases, alias offsets, leaves, leaf offsets,
+	ids, id offsets
+
+Numbers and offsets are arrays of uint32; an offset array has one more
+entry than there are leaves. The aliases of a leaf are joined by NUL,
+and so are its ids (see leaf_ids).
+
+Since each leaf is pickled on its own, objects that several leaves refer
+to (other than the source) are stored once for each leaf, and are
+separate objects after loading.
+
+A leaf that can't be unpickled when it is accessed is replaced by an
+invalid leaf, and the error handler of its LazyLeaves is called, so
+that the source can be loaded again.
+"""
+
+from __future__ import with_statement
+
+import array
+import cPickle as pickle
+import cStringIO
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+from kupfer import pretty
+from kupfer.obj import base
+from kupfer.core import qfurl
+
+MAGIC = "KUPFERCS"
+VERSION = 4
+
+_HEADER = struct.Struct("<8sIQ")
+_COUNT = struct.Struct("<I")
+_ENTRY = struct.Struct("<16sQQ16s")
+_LENGTH = struct.Struct("<I")
+
+(_SOURCE, _TYPES, _TYPE_NUMBERS, _NAMES, _NAME_OFFSETS, _ALIASES,
+ _ALIAS_OFFSETS, _LEAVES, _LEAF_OFFSETS, _IDS, _ID_OFFSETS) = range(11)
+_NUM_BLOBS = 11
+
+# persistent ids of the source and its leaves inside a section
+_SOURCE_ID = "source"
+_LEAVES_ID = "leaves"
+
+class SnapshotError (Exception):
+	pass
+
+def leaf_ids(leaf):
+	"""Return the ids that @leaf can be found by: its repr, and its
+	reduced qfurl if it has one
+	"""
+	ids = [repr(leaf)]
+	if hasattr(leaf, "qf_id"):
+		try:
+			ids.append(qfurl.qfurl.reduce_url(str(qfurl.qfurl(leaf))))
+		except qfurl.QfurlError:
+			pass
+	return ids
+
+def _array_to_string(numbers):
+	arr = array.array("I", numbers)
+	if sys.byteorder == "big":
+		arr.byteswap()
+	return arr.tostring()
+
+def _string_to_array(data):
+	arr = array.array("I")
+	arr.fromstring(data)
+	if sys.byteorder == "big":
+		arr.byteswap()
+	return arr
+
+def _join_bytes(parts):
+	"""Return (data, offsets) for the byte strings @parts"""
+	offsets = [0]
+	for part in parts:
+		offsets.append(offsets[-1] + len(part))
+	return "".join(parts), _array_to_string(offsets)
+
+def _split_bytes(data, offsets):
+	"""Return the list of byte strings of a column"""
+	return [data[start:end] for start, end in zip(offsets, offsets[1:])]
+
+def _join_column(strings):
+	"""Return (data, offsets) for the unicode @strings"""
+	return _join_bytes([s.encode("UTF-8") for s in strings])
+
+def _split_column(data, offsets):
+	"""Return the list of unicode strings of a column"""
+	return [part.decode("UTF-8") for part in _split_bytes(data, offsets)]
+
+def _pickle_leaves(leaves, source):
+	"""Return (data, offsets) with each of @leaves pickled on its own"""
+	out = cStringIO.StringIO()
+	pickler = pickle.Pickler(out, pickle.HIGHEST_PROTOCOL)
+	pickler.persistent_id = lambda obj: _SOURCE_ID if obj is source else None
+	offsets = [0]
+	for leaf in leaves:
+		pickler.clear_memo()
+		pickler.dump(leaf)
+		offsets.append(out.tell())
+	return out.getvalue(), _array_to_string(offsets)
+
+def make_section(source):
+	"""Return (data, fingerprint), the snapshot section of @source and
+	its cached leaves
+
+	May raise any exception from pickling
+
+	The fingerprint changes with any of the pickled data, also when
+	only the .object of a leaf changes:
+
+	>>> src = base.Source(u"Source")
+	>>> src.cached_items = [base.Leaf(u"http://a.org/", u"Home")]
+	>>> data, digest = make_section(src)
+	>>> src.cached_items = [base.Leaf(u"http://b.org/", u"Home")]
+	>>> make_section(src)[1] == digest
+	False
+	>>> src.cached_items = [base.Leaf(u"http://a.org/", u"Home")]
+	>>> make_section(src)[1] == digest
+	True
+	"""
+	items = source.cached_items
+	if isinstance(items, LazyLeaves) and items.failed:
+		raise SnapshotError("Leaves could not be loaded")
+	if isinstance(items, LazyLeaves):
+		blobs = items.get_blobs()
+	else:
+		leaves = list(items or ())
+		types = []
+		type_numbers = {}
+		for leaf in leaves:
+			if type(leaf) not in type_numbers:
+				type_numbers[type(leaf)] = len(types)
+				types.append(type(leaf))
+		blobs = [None, pickle.dumps(types, pickle.HIGHEST_PROTOCOL),
+		         _array_to_string([type_numbers[type(l)] for l in leaves])]
+		blobs.extend(_join_column([unicode(l) for l in leaves]))
+		blobs.extend(_join_column([u"\0".join(getattr(l, "name_aliases", ()))
+		                           for l in leaves]))
+		# the reprs are cached in the leaves, take the ids before
+		# pickling so that the leaves are pickled the same each time
+		ids = _join_bytes(["\0".join(leaf_ids(l)) for l in leaves])
+		blobs.extend(_pickle_leaves(leaves, source))
+		blobs.extend(ids)
+
+	out = cStringIO.StringIO()
+	pickler = pickle.Pickler(out, pickle.HIGHEST_PROTOCOL)
+	if items is not None:
+		pickler.persistent_id = \
+				lambda obj: _LEAVES_ID if obj is items else None
+	pickler.dump(source)
+	blobs[_SOURCE] = out.getvalue()
+	data = "".join(_LENGTH.pack(len(blob)) + str(blob) for blob in blobs)
+	return data, hashlib.md5(data).digest()
+
+def _write_sections(output, sections, index):
+	"""Write @sections at the end of @output, and then the index
+
+	@index: key -> (offset, length, fingerprint), updated in place
+	Return the offset of the index
+	"""
+	output.seek(0, os.SEEK_END)
+	offset = output.tell()
+	for key in sorted(sections):
+		data, digest = sections[key]
+		output.write(data)
+		index[key] = (offset, len(data), digest)
+		offset += len(data)
+	output.write(_COUNT.pack(len(index)))
+	for key in sorted(index):
+		output.write(_ENTRY.pack(key, *index[key]))
+	return offset
+
+def write_snapshot(path, sections):
+	"""Write the snapshot file @path
+
+	@sections: a dict of 16-byte key -> (section data, fingerprint),
+	the data a str or buffer
+	"""
+	tmp_path = "%s.%s" % (path, os.getpid())
+	with open(tmp_path, "wb") as output:
+		output.write(_HEADER.pack(MAGIC, VERSION, 0))
+		index_offset = _write_sections(output, sections, {})
+		output.seek(0)
+		output.write(_HEADER.pack(MAGIC, VERSION, index_offset))
+	os.rename(tmp_path, path)
+
+def append_snapshot(snapshot, sections):
+	"""Add @sections to the file of the open @snapshot, replacing the
+	sections with the same keys
+
+	The snapshot is updated in place, and the header is written last:
+	if writing is interrupted, the file is left as it was, or
+	unreadable. @snapshot itself still reads the file as it was.
+	"""
+	index = dict(snapshot._sections)
+	with open(snapshot.path, "r+b") as output:
+		index_offset = _write_sections(output, sections, index)
+		output.flush()
+		output.seek(0)
+		output.write(_HEADER.pack(MAGIC, VERSION, index_offset))
+
+class CatalogSnapshot (object):
+	"""A snapshot file, opened for reading"""
+	def __init__(self, path):
+		"""Open the snapshot at @path
+
+		Raise EnvironmentError if it can't be read, and
+		SnapshotError if it is not a snapshot of this version
+		"""
+		self.path = path
+		with open(path, "rb") as infile:
+			self.stat = os.fstat(infile.fileno())
+			if self.stat.st_size < _HEADER.size:
+				raise SnapshotError("File is too short")
+			self._mapped = mmap.mmap(infile.fileno(), 0,
+			                         access=mmap.ACCESS_READ)
+		size = len(self._mapped)
+		magic, version, index_offset = _HEADER.unpack_from(self._mapped, 0)
+		if magic != MAGIC or version != VERSION:
+			raise SnapshotError("Not a snapshot of version %d" % VERSION)
+		if index_offset + _COUNT.size > size:
+			raise SnapshotError("Truncated file")
+		count, = _COUNT.unpack_from(self._mapped, index_offset)
+		if index_offset + _COUNT.size + count * _ENTRY.size > size:
+			raise SnapshotError("Truncated file")
+		# key -> (offset, length, fingerprint)
+		self._sections = {}
+		for num in xrange(count):
+			pos = index_offset + _COUNT.size + num * _ENTRY.size
+			key, offset, length, digest = _ENTRY.unpack_from(self._mapped, pos)
+			if offset + length > index_offset:
+				raise SnapshotError("Truncated file")
+			self._sections[key] = (offset, length, digest)
+		self.live_size = (_HEADER.size + _COUNT.size + count * _ENTRY.size +
+		                  sum(entry[1] for entry in self._sections.itervalues()))
+
+	def __contains__(self, key):
+		return key in self._sections
+
+	def keys(self):
+		return self._sections.keys()
+
+	def wasted_size(self):
+		"""Return the size of replaced data in the file"""
+		return len(self._mapped) - self.live_size
+
+	def get_fingerprint(self, key):
+		return self._sections[key][2]
+
+	def get_section(self, key):
+		"""Return (data, fingerprint) of the section @key,
+		the data as a buffer"""
+		offset, length, digest = self._sections[key]
+		return buffer(self._mapped, offset, length), digest
+
+	def _get_blobs(self, key):
+		"""Return the (start, end) of each blob in section @key"""
+		offset, length, digest = self._sections[key]
+		end = offset + length
+		blobs = []
+		pos = offset
+		for num in xrange(_NUM_BLOBS):
+			if pos + _LENGTH.size > end:
+				raise SnapshotError("Truncated section")
+			blob_length, = _LENGTH.unpack_from(self._mapped, pos)
+			pos += _LENGTH.size
+			blobs.append((pos, pos + blob_length))
+			pos += blob_length
+		if pos > end:
+			raise SnapshotError("Truncated section")
+		return blobs
+
+	def load_source(self, key):
+		"""Return the source stored in section @key
+
+		Its cached leaves are a LazyLeaves sequence.
+		May raise any exception from unpickling.
+		"""
+		leaves = LazyLeaves(self._mapped, self._get_blobs(key))
+		data = leaves.get_blob(_SOURCE)
+		unpickler = pickle.Unpickler(cStringIO.StringIO(data))
+		unpickler.persistent_load = {_LEAVES_ID: leaves}.__getitem__
+		source = unpickler.load()
+		leaves.load_types(source)
+		return source
+
+	def load_leaves(self, key, source):
+		"""Return the leaves stored in section @key, for @source,
+		as a LazyLeaves sequence
+
+		May raise any exception from unpickling.
+		"""
+		leaves = LazyLeaves(self._mapped, self._get_blobs(key))
+		leaves.load_types(source)
+		return leaves
+
+class UnloadableLeaf (base.Leaf):
+	"""Takes the place of a leaf that could not be unpickled"""
+	def __init__(self, name):
+		base.Leaf.__init__(self, None, name)
+
+	def is_valid(self):
+		return False
+
+class LazyLeaves (object):
+	"""
+	The cached leaves of a source in a snapshot, a sequence that
+	unpickles each leaf when it is first accessed
+
+	If a leaf can't be unpickled, an invalid leaf is returned in its
+	place, .failed is set and .on_load_error is called with the
+	sequence, once, in the thread that accessed the leaf.
+	"""
+	def __init__(self, mapped, blobs):
+		self._mapped = mapped
+		self._blobs = blobs
+		self._offsets = _string_to_array(self.get_blob(_LEAF_OFFSETS))
+		self._leaves = [None] * (len(self._offsets) - 1)
+		self._source = None
+		self.failed = False
+		self.on_load_error = None
+
+	@property
+	def source(self):
+		return self._source
+
+	def get_blob(self, num):
+		start, end = self._blobs[num]
+		return self._mapped[start:end]
+
+	def get_blobs(self):
+		"""Return the blobs of the section, without the source pickle"""
+		return [None] + [buffer(self._mapped, start, end - start)
+		                 for start, end in self._blobs[1:]]
+
+	def load_types(self, source):
+		"""Import the leaf types, and load the leaves of types that
+		validate themselves. May raise any exception from unpickling.
+		"""
+		self._source = source
+		types = pickle.loads(self.get_blob(_TYPES))
+		eager = [hasattr(typ, "__setstate__") for typ in types]
+		numbers = _string_to_array(self.get_blob(_TYPE_NUMBERS))
+		for idx, number in enumerate(numbers):
+			if eager[number]:
+				self._leaves[idx] = self._load_leaf(idx)
+
+	def _load_leaf(self, idx):
+		start = self._blobs[_LEAVES][0]
+		offsets = self._offsets
+		data = self._mapped[start + offsets[idx]:start + offsets[idx + 1]]
+		unpickler = pickle.Unpickler(cStringIO.StringIO(data))
+		unpickler.persistent_load = {_SOURCE_ID: self._source}.__getitem__
+		return unpickler.load()
+
+	def _load_leaf_or_substitute(self, idx):
+		try:
+			return self._load_leaf(idx)
+		except Exception, exc:
+			pretty.print_error(__name__, "Could not load leaf %d of %s: %s" %
+					(idx, self._source, exc))
+		leaf = UnloadableLeaf(self.get_names()[idx])
+		if not self.failed:
+			self.failed = True
+			if self.on_load_error is not None:
+				self.on_load_error(self)
+		return leaf
+
+	def get_names(self):
+		"""Return the names of the leaves, without loading them"""
+		return _split_column(self.get_blob(_NAMES),
+		                     _string_to_array(self.get_blob(_NAME_OFFSETS)))
+
+	def get_aliases(self):
+		"""Return the aliases of each leaf, without loading them"""
+		joined = _split_column(self.get_blob(_ALIASES),
+		                       _string_to_array(self.get_blob(_ALIAS_OFFSETS)))
+		return [tuple(a.split(u"\0")) if a else () for a in joined]
+
+	def get_ids(self):
+		"""Return the ids of each leaf (see leaf_ids), without
+		loading them"""
+		joined = _split_bytes(self.get_blob(_IDS),
+		                      _string_to_array(self.get_blob(_ID_OFFSETS)))
+		return [tuple(ids.split("\0")) for ids in joined]
+
+	def load_all(self):
+		"""Load all leaves now"""
+		for leaf in self:
+			pass
+
+	def loaded_count(self):
+		"""Return the number of leaves that are loaded"""
+		return len(self._leaves) - self._leaves.count(None)
+
+	def memory_size(self):
+		"""Return an estimate of the memory used, in bytes, not counting
+		the mapped file"""
+		return (sys.getsizeof(self._leaves) + sys.getsizeof(self._offsets) +
+		        sum(_leaf_size(leaf) for leaf in self._leaves
+		            if leaf is not None))
+
+	def __len__(self):
+		return len(self._leaves)
+
+	def __getitem__(self, idx):
+		if isinstance(idx, slice):
+			return [self[i] for i in xrange(*idx.indices(len(self)))]
+		if idx < 0:
+			idx += len(self._leaves)
+		leaf = self._leaves[idx]
+		if leaf is None:
+			leaf = self._leaves[idx] = self._load_leaf_or_substitute(idx)
+		return leaf
+
+	def __iter__(self):
+		for idx in xrange(len(self._leaves)):
+			yield self[idx]
+
+	def __reduce__(self):
+		"""Pickle into a list"""
+		return (list, (list(self), ))
+
+def _leaf_size(leaf):
+	size = sys.getsizeof(leaf)
+	attributes = getattr(leaf, "__dict__", None)
+	if attributes is not None:
+		size += sys.getsizeof(attributes)
+		size += sum(sys.getsizeof(value) for value in attributes.itervalues()
+		            if isinstance(value, basestring))
+	return size
+
+def memory_size(items):
+	"""Return an estimate of the memory used by the cached items @items
+	of a source, in bytes"""
+	if items is None:
+		return 0
+	if isinstance(items, LazyLeaves):
+		return items.memory_size()
+	leaves = getattr(items, "data", items)
+	return sys.getsizeof(leaves) + sum(_leaf_size(leaf) for leaf in leaves)
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
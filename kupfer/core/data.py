@@ -4,6 +4,7 @@ import itertools
 import operator
 import os
 import sys
+import time
 
 import gobject
 gobject.threads_init()
@@ -12,11 +13,13 @@ from kupfer.obj import base, sources, compose
 from kupfer import pretty, scheduler
 from kupfer import datatools
 from kupfer.core import actioncompat
+from kupfer.core import catalogindex
 from kupfer.core import commandexec
 from kupfer.core import execfile
 from kupfer.core import pluginload
 from kupfer.core import qfurl
 from kupfer.core import search, learn
+from kupfer.core import searchworker
 from kupfer.core import settings
 
 from kupfer.core.sources import GetSourceController
@@ -30,6 +33,13 @@ SourceActionMode, SourceActionObjectMode = (1,2)
 
 DATA_SAVE_INTERVAL_S = 3660
 
+# Number of best matches to select before sorting all matches
+SEARCH_TOP_K = 50
+
+# In progressive search, sources with more leaves than this
+# are ranked after the first result is shown
+PROGRESSIVE_LARGE_SOURCE = 2000
+
 def identity(x):
 	return x
 
@@ -43,6 +53,18 @@ def dress_leaves(seq, action):
 		sc.decorate_object(itm.object, action=action)
 		yield itm
 
+def expand_sources(srcs):
+	"""yield the sources of @srcs, where each MultiSource is replaced
+	by the sources it combines, so that they can be searched
+	(and indexed) one by one
+	"""
+	for src in srcs:
+		if isinstance(src, sources.MultiSource):
+			for subsrc in expand_sources(src.get_toplevel_sources()):
+				yield subsrc
+		else:
+			yield src
+
 def peekfirst(seq):
 	"""This function will return (firstitem, iter)
 	where firstitem is the first item of @seq or None if empty,
@@ -54,25 +76,82 @@ def peekfirst(seq):
 		return (itm, old_iter)
 	return (None, seq)
 
+def is_slow_source(src):
+	"""Return True if @src is expensive to rank, because it is large or
+	its leaves are not loaded yet
+	"""
+	if is_iterable(src) or hasattr(src, "get_text_items"):
+		return False
+	if src.is_dynamic():
+		return False
+	items = src.cached_items
+	if items is None:
+		return True
+	if isinstance(items, datatools.SavedIterable):
+		if items.iterator is not None:
+			return True
+		items = items.data
+	return len(items) > PROGRESSIVE_LARGE_SOURCE
+
+def is_same_match(match, other):
+	"""Return True if the matches @match and @other, which may be None,
+	show the same object at the same rank
+
+	>>> is_same_match(search.Rankable(u"a", 1, 50), search.Rankable(u"a", 1, 50))
+	True
+	>>> is_same_match(search.Rankable(u"a", 1, 50), search.Rankable(u"a", 1, 60))
+	False
+	>>> is_same_match(None, search.Rankable(u"a", 1, 50))
+	False
+	"""
+	if match is None or other is None:
+		return match is other
+	return match.object == other.object and match.rank == other.rank
+
+class ReplaceableIterator (object):
+	"""An iterator of @seq, which can be replaced by another sequence
+	until its first item is taken
+	"""
+	def __init__(self, seq):
+		self._iter = iter(seq)
+		self._started = False
+
+	def __iter__(self):
+		return self
+
+	def next(self):
+		self._started = True
+		return self._iter.next()
+
+	def replace(self, seq):
+		"""Iterate @seq instead, and return True if it was possible"""
+		if self._started:
+			return False
+		self._iter = iter(seq)
+		return True
+
 class Searcher (object):
 	"""
 	This class searches KupferObjects efficiently, and
 	stores searches in a cache for a very limited time (*)
 
 	(*) As of this writing, the cache is used when the old key
-	is a prefix of the search key.
+	is a prefix of the search key. Sources with a catalog index
+	instead use the query results remembered by their index.
 	"""
 
-	def __init__(self):
+	def __init__(self, top_k=SEARCH_TOP_K):
 		self._source_cache = {}
 		self._old_key = None
+		self.top_k = top_k
 
 	def search(self, sources, key, score=True, item_check=None, decorator=None):
 		"""
 		@sources is a sequence listing the inputs, which should be
 		Sources, TextSources or sequences of KupferObjects
 
-		If @score, sort by rank.
+		If @score, sort by rank. The best .top_k matches are selected
+		first, the rest is only sorted when the iteration gets to it.
 		filters (with identity() as default):
 			@item_check: Check items before adding to search pool
 			@decorator: Decorate items before access
@@ -80,60 +159,172 @@ class Searcher (object):
 		Return (first, match_iter), where first is the first match,
 		and match_iter an iterator to all matches, including the first match.
 		"""
+		self._update_key(key)
+		if not item_check: item_check = identity
+		if not decorator: decorator = identity
+
+		match_iters = [self._source_matches(src, key, score, item_check)
+		               for src in expand_sources(sources)]
+		matches = self._sort_matches(match_iters, score)
+		return self._finish_matches(matches, decorator)
+
+	def snapshot(self, sources, key):
+		"""
+		Return the search inputs of @sources for @key, with the items
+		of every source listed, to be ranked with .rank_sources
+
+		This must be called in the main thread. Everything that ranking
+		shares with the main thread is prepared here: the leaves are
+		loaded and the catalog index of each source is built, so that
+		the inputs are not changed while they are ranked.
+		"""
+		snapshot = []
+		for src in expand_sources(sources):
+			if is_iterable(src):
+				snapshot.append((list(src), None))
+				continue
+			items, text_rank = self._source_inputs(src, key)
+			if isinstance(items, datatools.SavedIterable):
+				# complete the source's cache, so that it can be indexed
+				for _ in items:
+					pass
+			elif hasattr(items, "load_all"):
+				# leaves from the catalog snapshot, load them here
+				items.load_all()
+			elif not isinstance(items, (list, tuple)):
+				items = list(items)
+			index = None
+			if text_rank is None:
+				index = catalogindex.get_index(src, items)
+			snapshot.append((src, (items, text_rank, index)))
+		return snapshot
+
+	def rank_sources(self, entries, key, score=True, cancelled=None):
+		"""
+		Rank each of @entries for @key, like .search does for sources;
+		this may be called in another thread, but only one at a time
+		per Searcher.
+
+		@entries: (source, inputs) pairs, as returned by .snapshot;
+		          inputs may be None for sources that can be read here
+		@cancelled: a function returning True when the result is no
+		            longer needed
+
+		Return a list of the matches of each entry, to be merged with
+		.merge_ranked, or None if cancelled
+		"""
+		self._update_key(key)
+		ranked = []
+		for src, inputs in entries:
+			if cancelled and cancelled():
+				return None
+			matches = self._source_matches(src, key, score, identity, inputs)
+			if cancelled:
+				matches = datatools.cancellable(matches, cancelled)
+			ranked.append(list(matches))
+		if cancelled and cancelled():
+			return None
+		return ranked
+
+	def merge_ranked(self, ranked, score=True):
+		"""
+		Return the matches of all the lists in @ranked, from
+		.rank_sources, sorted if @score and with the best already
+		selected, to be finished with .finish_snapshot
+		"""
+		return peekfirst(self._sort_matches(ranked, score))[1]
+
+	def finish_snapshot(self, matches, item_check=None, decorator=None):
+		"""
+		Filter and decorate the ranked @matches from .merge_ranked,
+		in the main thread
+
+		Return (first, match_iter) like .search
+		"""
+		if not decorator: decorator = identity
+		if item_check:
+			matches = (rb for rb in matches
+			           if any(True for _ in item_check((rb.object, ))))
+		return self._finish_matches(matches, decorator)
+
+	def _update_key(self, key):
 		if not self._old_key or not key.startswith(self._old_key):
 			self._source_cache.clear()
 		self._old_key = key
 
-		if not item_check: item_check = identity
-		if not decorator: decorator = identity
+	def _source_inputs(self, src, key):
+		"""Return (items, text_rank) of @src for @key, where text_rank
+		is None unless @src is a text source"""
+		try:
+			return src.get_text_items(key), src.get_rank()
+		except AttributeError:
+			return src.get_leaves(), None
 
-		match_iters = []
-		for src in sources:
-			fixedrank = 0
-			can_cache = True
-			rankables = None
-			if is_iterable(src):
-				items = item_check(src)
-				can_cache = False
-			else:
-				# Look in source cache for stored rankables
-				try:
-					rankables = self._source_cache[src]
-				except KeyError:
-					try:
-						items = item_check(src.get_text_items(key))
-						fixedrank = src.get_rank()
-						can_cache = False
-					except AttributeError:
-						items = item_check(src.get_leaves())
-
-			if not rankables:
-				rankables = search.make_rankables(items)
-
-			if score:
-				if fixedrank:
-					rankables = search.add_rank_objects(rankables, fixedrank)
-				elif key:
-					rankables = search.score_objects(rankables, key)
-				matches = search.bonus_objects(rankables, key)
-				if can_cache:
-					# we fork off a copy of the iterator to save
-					matches, self._source_cache[src] = itertools.tee(matches)
-			else:
-				# we only want to list them
-				matches = rankables
+	def _source_matches(self, src, key, score, item_check, inputs=None):
+		"""
+		Return an iterator of the matches for @key in @src
+
+		@inputs: (items, text_rank, index) as returned by .snapshot,
+		         if already available
+		"""
+		fixedrank = 0
+		can_cache = True
+		rankables = None
+		scored = False
+		if is_iterable(src):
+			items = item_check(src)
+			can_cache = False
+		else:
+			# Look in source cache for stored rankables
+			try:
+				rankables = self._source_cache[src]
+			except KeyError:
+				if inputs is None:
+					items, text_rank = self._source_inputs(src, key)
+					index = None
+					if text_rank is None and score and key:
+						index = catalogindex.get_index(src, items)
+				else:
+					items, text_rank, index = inputs
+				if text_rank is not None:
+					items = item_check(items)
+					fixedrank = text_rank
+					can_cache = False
+				else:
+					if score and key:
+						rankables = self._score_indexed(index, key, item_check)
+						scored = rankables is not None
+						can_cache = not scored
+					if not scored:
+						items = item_check(items)
+
+		if rankables is None:
+			rankables = search.make_rankables(items)
 
-			match_iters.append(matches)
-		
-		matches = itertools.chain(*match_iters)
 		if score:
-			matches = sorted(matches, key=operator.attrgetter("rank"),
-					reverse=True)
+			if fixedrank:
+				rankables = search.add_rank_objects(rankables, fixedrank)
+			elif key and not scored:
+				rankables = search.score_objects(rankables, key)
+			matches = search.bonus_objects(rankables, key)
+			if can_cache:
+				# we fork off a copy of the iterator to save
+				matches, self._source_cache[src] = itertools.tee(matches)
+		else:
+			# we only want to list them
+			matches = rankables
+		return matches
 
-		def as_set_iter(seq):
-			key = operator.attrgetter("object")
-			return datatools.UniqueIterator(seq, key=key)
+	def _sort_matches(self, match_iters, score):
+		"""Return the unique matches of @match_iters, sorted if @score"""
+		matches = itertools.chain(*match_iters)
+		if score:
+			matches = datatools.top_sorted(matches, self.top_k,
+					key=operator.attrgetter("rank"), reverse=True)
+		key = operator.attrgetter("object")
+		return datatools.UniqueIterator(matches, key=key)
 
+	def _finish_matches(self, matches, decorator):
 		def valid_check(seq):
 			"""yield items of @seq that are valid"""
 			for itm in seq:
@@ -143,10 +334,30 @@ class Searcher (object):
 
 		# Check if the items are valid as the search
 		# results are accessed through the iterators
-		unique_matches = as_set_iter(matches)
-		match, match_iter = peekfirst(decorator(valid_check(unique_matches)))
+		match, match_iter = peekfirst(decorator(valid_check(matches)))
 		return match, match_iter
 
+	def _score_indexed(self, index, key, item_check):
+		"""Score the leaves of the catalog index @index for @key
+
+		Return a list of rankables, or None if there is no index
+		"""
+		if index is None:
+			return None
+		key = key.lower()
+		result = index.get_result(key)
+		if result is None:
+			positions = list(index.refine_positions(key))
+			scored = search.score_indexed(index, positions, key)
+			result = catalogindex.QueryResult(scored)
+			index.set_result(key, result)
+		scored = iter(result)
+		if item_check is not identity:
+			leaves = index.leaves
+			scored = (entry for entry in scored
+			          if any(True for _ in item_check((leaves[entry[0]], ))))
+		return search.make_indexed_rankables(index, scored)
+
 	def rank_actions(self, objects, key, leaf, item_check=None, decorator=None):
 		"""
 		rank @objects, which should be a sequence of KupferObjects,
@@ -183,6 +394,10 @@ class Pane (gobject.GObject):
 		self.outstanding_search = -1
 		self.outstanding_search_id = -1
 		self.searcher = Searcher()
+		self.search_worker = None
+		self.progressive_search = False
+		self.outstanding_search_step = -1
+		self.latest_search_timing = None
 
 	def select(self, item):
 		self.selection = item
@@ -198,6 +413,20 @@ class Pane (gobject.GObject):
 		return False
 	def emit_search_result(self, match, match_iter, context):
 		self.emit("search-result", match, match_iter, context)
+	def set_search_worker(self, worker):
+		"""Rank searches in the SearchWorker @worker, or, if None,
+		in the main loop"""
+		self.search_worker = worker
+	def set_progressive_search(self, enabled):
+		"""If @enabled, emit the result of the fast sources first, and
+		then the result of all sources if the first match changes"""
+		self.progressive_search = enabled
+	def cancel_background_search(self):
+		if self.search_worker is not None:
+			self.search_worker.cancel(self)
+		if self.outstanding_search_step > 0:
+			gobject.source_remove(self.outstanding_search_step)
+			self.outstanding_search_step = -1
 
 gobject.signal_new("search-result", Pane, gobject.SIGNAL_RUN_LAST,
 		gobject.TYPE_BOOLEAN, (gobject.TYPE_PYOBJECT, gobject.TYPE_PYOBJECT, 
@@ -306,10 +535,123 @@ class LeafPane (Pane, pretty.OutputMixin):
 			sources.extend(textsrcs)
 
 		decorator = lambda seq: dress_leaves(seq, action=None)
-		match, match_iter = self.searcher.search(sources, key, score=bool(key),
+		self._search_sources(sources, key, context, score=bool(key),
 				decorator=decorator)
+
+	def _search_sources(self, sources, key, context, score=True,
+			item_check=None, decorator=None):
+		"""Search @sources for @key and emit the result
+
+		If we have a search worker, the items of @sources are ranked in
+		its thread, and the result is emitted when it is ready.
+
+		In progressive search, large and unloaded sources are ranked
+		after the result of the others is emitted; the result of all
+		sources is emitted if it has another first match, else it
+		replaces the rest of the matches if they were not used yet,
+		and the emitted result is kept.
+		"""
+		searcher = self.searcher
+		start_time = time.time()
+		self.latest_search_timing = None
+		progressive = self.progressive_search and score and key
+		if self.search_worker is None and not progressive:
+			match, match_iter = searcher.search(sources, key, score=score,
+					item_check=item_check, decorator=decorator)
+			self._emit_timed_result(match, match_iter, context, key,
+					start_time, True)
+			return
+
+		if self.search_worker is None:
+			entries = [(src, None) for src in expand_sources(sources)]
+		else:
+			entries = searcher.snapshot(sources, key)
+		is_slow = [progressive and is_slow_source(src) for src, _ in entries]
+		first_entries = [e for e, slow in zip(entries, is_slow) if not slow]
+		rest_entries = [e for e, slow in zip(entries, is_slow) if slow]
+
+		def finish(matches, last):
+			match, match_iter = searcher.finish_snapshot(matches, item_check,
+					decorator)
+			if not last:
+				match_iter = ReplaceableIterator(match_iter)
+			self._emit_timed_result(match, match_iter, context, key,
+					start_time, last)
+			return match, match_iter
+
+		def rank_first(cancelled):
+			ranked = searcher.rank_sources(first_entries, key, score, cancelled)
+			if ranked is None:
+				return None
+			return ranked, searcher.merge_ranked(ranked, score)
+
+		def finish_first(result):
+			first_ranked, matches = result
+			first_match, first_iter = finish(matches, not rest_entries)
+			if not rest_entries:
+				return
+
+			def rank_rest(cancelled):
+				ranked = searcher.rank_sources(rest_entries, key, score,
+						cancelled)
+				if ranked is None:
+					return None
+				# merge in the order of the sources, as .search does
+				first_ranked_iter = iter(first_ranked)
+				rest_ranked_iter = iter(ranked)
+				ranked = [(rest_ranked_iter if slow else first_ranked_iter).next()
+				          for slow in is_slow]
+				return searcher.merge_ranked(ranked, score)
+
+			def finish_rest(matches):
+				match, match_iter = searcher.finish_snapshot(matches,
+						item_check, decorator)
+				if is_same_match(match, first_match):
+					first_iter.replace(match_iter)
+					self._log_timing(key, start_time, True)
+					return
+				self._emit_timed_result(match, match_iter, context, key,
+						start_time, True)
+
+			self._run_search_step(rank_rest, finish_rest)
+
+		self._run_search_step(rank_first, finish_first, now=True)
+
+	def _run_search_step(self, job, finish, now=False):
+		"""Run @job(cancelled) in the search worker, or in the main loop,
+		and then pass its result to @finish
+
+		Without search worker, run it @now or else when idle
+		"""
+		if self.search_worker is not None:
+			self.search_worker.submit(self, job, finish)
+		elif now:
+			finish(job(None))
+		else:
+			def idle_step():
+				self.outstanding_search_step = -1
+				finish(job(None))
+				return False
+			self.outstanding_search_step = gobject.idle_add(idle_step)
+
+	def _emit_timed_result(self, match, match_iter, context, key, start_time,
+			last):
+		self._log_timing(key, start_time, last)
 		self.emit_search_result(match, match_iter, context)
 
+	def _log_timing(self, key, start_time, last):
+		"""Record the time since @start_time of the search for @key in
+		.latest_search_timing: (key, first result, last result) in seconds
+		"""
+		duration = time.time() - start_time
+		timing = self.latest_search_timing or (key, duration, None)
+		if last:
+			timing = (key, timing[1], duration)
+			self.output_debug("Search %r, first result in %.1f ms, "
+					"all results in %.1f ms" %
+					(key, timing[1]*1000, duration*1000))
+		self.latest_search_timing = timing
+
 gobject.signal_new("new-source", LeafPane, gobject.SIGNAL_RUN_LAST,
 		gobject.TYPE_BOOLEAN, (gobject.TYPE_PYOBJECT,))
 
@@ -411,9 +753,8 @@ class SecondaryObjectPane (LeafPane):
 				self.current_item)
 		decorator = lambda seq: dress_leaves(seq, action=self.current_action)
 
-		match, match_iter = self.searcher.search(sources, key, score=True,
+		self._search_sources(sources, key, context, score=True,
 				item_check=item_check, decorator=decorator)
-		self.emit_search_result(match, match_iter, context)
 
 class DataController (gobject.GObject, pretty.OutputMixin):
 	"""
@@ -449,6 +790,8 @@ class DataController (gobject.GObject, pretty.OutputMixin):
 				self._late_command_execution_result)
 
 		self._save_data_timer = scheduler.Timer()
+		# plugin id -> names of leaf types to load it for
+		self._deferred_plugins = {}
 
 		sch = scheduler.GetScheduler()
 		sch.connect("load", self._load)
@@ -508,6 +851,14 @@ class DataController (gobject.GObject, pretty.OutputMixin):
 		setctl.connect("plugin-enabled-changed", self._plugin_enabled)
 		setctl.connect("plugin-toplevel-changed", self._plugin_catalog_changed)
 
+		if setctl.get_background_search():
+			worker = searchworker.GetSearchWorker()
+			self.source_pane.set_search_worker(worker)
+			self.object_pane.set_search_worker(worker)
+		if setctl.get_progressive_search():
+			self.source_pane.set_progressive_search(True)
+			self.object_pane.set_progressive_search(True)
+
 		self._load_all_plugins()
 		D_s, d_s = self._get_directory_sources()
 		sc = GetSourceController()
@@ -562,26 +913,58 @@ class DataController (gobject.GObject, pretty.OutputMixin):
 		from kupfer.core import plugins
 
 		setctl = settings.GetSettingsController()
+		defer = setctl.get_defer_plugins()
 		for item in sorted(plugins.get_plugin_ids()):
 			if not setctl.get_plugin_enabled(item):
 				continue
+			deferred_types = defer and pluginload.get_deferred_types(item)
+			if deferred_types:
+				self.output_debug("Deferring plugin", item)
+				self._deferred_plugins[item] = set(deferred_types)
+				continue
 			sources = self._load_plugin(item)
 			self._insert_sources(item, sources, initialize=False)
+		plugins.save_plugin_index()
 
 	def _load_plugin(self, plugin_id):
 		"""
 		Load @plugin_id, register all its Actions, Content and TextSources.
 		Return its sources.
 		"""
+		from kupfer.core import plugins
+
 		with pluginload.exception_guard(plugin_id):
 			plugin = pluginload.load_plugin(plugin_id)
 			self.register_text_sources(plugin_id, plugin.text_sources)
 			self.register_action_decorators(plugin_id, plugin.action_decorators)
 			self.register_content_decorators(plugin_id, plugin.content_decorators)
 			self.register_action_generators(plugin_id, plugin.action_generators)
+			plugins.set_decorated_types(plugin_id,
+					pluginload.get_decorated_type_names(plugin))
 			return set(plugin.sources)
 		return set()
 
+	def _load_deferred_plugins(self, leaf):
+		"""Load the deferred plugins that apply to @leaf
+
+		Return True if any plugin was loaded
+		"""
+		if not self._deferred_plugins or leaf is None:
+			return False
+		type_names = pluginload.get_type_names(leaf)
+		loaded = False
+		for plugin_id, plugin_types in self._deferred_plugins.items():
+			if plugin_types.isdisjoint(type_names):
+				continue
+			self.output_debug("Loading deferred plugin", plugin_id)
+			del self._deferred_plugins[plugin_id]
+			self._load_plugin(plugin_id)
+			loaded = True
+		if loaded:
+			# redecorate, since the plugins may provide its content
+			GetSourceController().decorate_object(leaf)
+		return loaded
+
 	def _plugin_enabled(self, setctl, plugin_id, enabled):
 		from kupfer.core import plugins
 		if enabled and not plugins.is_plugin_loaded(plugin_id):
@@ -591,6 +974,8 @@ class DataController (gobject.GObject, pretty.OutputMixin):
 			self._remove_plugin(plugin_id)
 
 	def _remove_plugin(self, plugin_id):
+		if self._deferred_plugins.pop(plugin_id, None) is not None:
+			return
 		sc = GetSourceController()
 		if sc.remove_objects_for_plugin_id(plugin_id):
 			self._reload_source_root()
@@ -631,6 +1016,7 @@ class DataController (gobject.GObject, pretty.OutputMixin):
 		learn.save()
 		GetSourceController().save_data()
 		if not final_invocation:
+			GetSourceController().spill_sources()
 			self._save_data_timer.set(DATA_SAVE_INTERVAL_S, self._save_data)
 
 	def _new_source(self, ctr, src):
@@ -659,6 +1045,7 @@ class DataController (gobject.GObject, pretty.OutputMixin):
 			if ctl.outstanding_search > 0:
 				gobject.source_remove(ctl.outstanding_search)
 				ctl.outstanding_search = -1
+			ctl.cancel_background_search()
 
 	def search(self, pane, key=u"", context=None, interactive=False, lazy=False,
 			text_mode=False):
@@ -699,6 +1086,8 @@ class DataController (gobject.GObject, pretty.OutputMixin):
 			return
 		self.cancel_search()
 		panectl.select(item)
+		if pane in (SourcePane, ObjectPane):
+			self._load_deferred_plugins(item)
 		if pane is SourcePane:
 			assert not item or isinstance(item, base.Leaf), \
 					"Selection in Source pane is not a Leaf!"
@@ -856,7 +1245,7 @@ class DataController (gobject.GObject, pretty.OutputMixin):
 		"""Find object with URI @url and select it in the first pane"""
 		sc = GetSourceController()
 		qf = qfurl.qfurl(url=url)
-		found = qf.resolve_in_catalog(sc.sources)
+		found = qf.resolve_in_catalog(sc.sources, sc.find_leaf)
 		if found and not found == self.source_pane.get_selection():
 			self._insert_object(SourcePane, found)
 
@@ -1009,4 +1398,6 @@ gobject.signal_new("command-result", DataController, gobject.SIGNAL_RUN_LAST,
 gobject.signal_new("launched-action", DataController, gobject.SIGNAL_RUN_LAST,
 		gobject.TYPE_BOOLEAN, ())
 
-
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
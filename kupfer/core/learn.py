@@ -1,5 +1,9 @@
+from __future__ import with_statement
+
+import bisect
 import cPickle as pickle
 import os
+import threading
 
 from kupfer import config
 from kupfer import conspickle
@@ -15,34 +19,96 @@ _default_actions = {
 }
 _register = {}
 _favorites = set()
+# Mnemonics are read by searches in the search worker thread, while
+# they are changed in the main thread; this guards the change of a
+# mnemonic together with its sorted index
+_mnemonics_lock = threading.Lock()
 
 
+def _prefix_end(prefix):
+	"""Return the least string greater than all strings starting with @prefix,
+	or None if there is no such string"""
+	for idx in xrange(len(prefix) - 1, -1, -1):
+		try:
+			return prefix[:idx] + unichr(ord(prefix[idx]) + 1)
+		except ValueError:
+			continue
+	return None
+
 class Mnemonics (object):
 	"""
 	Class to describe a collection of mnemonics
 	as well as the total count
+
+	>>> mns = Mnemonics()
+	>>> for m in (u"f", u"fi", u"fir", u"fir", u"g"):
+	...     mns.increment(m)
+	>>> mns.get_prefix_count(u"fi"), mns.get_prefix_count(u"")
+	(3, 5)
+	>>> mns.increment(u"fix")
+	>>> mns.get_prefix_count(u"fi"), mns.get_prefix_count(u"fj")
+	(4, 0)
+	>>> mns.decrement()
+	>>> mns.get_prefix_count(u"")
+	5
+
+	The counts may be read in any thread.
 	"""
+	# The sorted mnemonics and the cumulative sums of their counts,
+	# computed when needed
+	_sorted_index = None
+
 	def __init__(self):
 		self.mnemonics = dict()
 		self.count = 0
 	def __repr__(self):
 		return "<%s %d %s>" % (self.__class__.__name__, self.count, "".join(["%s: %d, " % (m,c) for m,c in self.mnemonics.iteritems()]))
+	def __getstate__(self):
+		state = dict(vars(self))
+		state.pop("_sorted_index", None)
+		return state
 	def increment(self, mnemonic=None):
 		if mnemonic:
-			mcount = self.mnemonics.get(mnemonic, 0)
-			self.mnemonics[mnemonic] = mcount + 1
+			with _mnemonics_lock:
+				mcount = self.mnemonics.get(mnemonic, 0)
+				self.mnemonics[mnemonic] = mcount + 1
+				self._sorted_index = None
 		self.count += 1
 
 	def decrement(self):
 		"""Decrement total count and the least mnemonic"""
 		if self.mnemonics:
-			key = min(self.mnemonics, key=lambda k: self.mnemonics[k])
-			if self.mnemonics[key] <= 1:
-				del self.mnemonics[key]
-			else:
-				self.mnemonics[key] -= 1
+			with _mnemonics_lock:
+				key = min(self.mnemonics, key=lambda k: self.mnemonics[k])
+				if self.mnemonics[key] <= 1:
+					del self.mnemonics[key]
+				else:
+					self.mnemonics[key] -= 1
+				self._sorted_index = None
 		self.count = max(self.count -1, 0)
 
+	def _get_sorted_index(self):
+		sorted_index = self._sorted_index
+		if sorted_index is None:
+			with _mnemonics_lock:
+				keys = sorted(self.mnemonics)
+				sums = [0]
+				for key in keys:
+					sums.append(sums[-1] + self.mnemonics[key])
+				sorted_index = self._sorted_index = (keys, sums)
+		return sorted_index
+
+	def get_prefix_count(self, prefix):
+		"""Return the sum of the counts of mnemonics starting with @prefix"""
+		keys, sums = self._get_sorted_index()
+		start = bisect.bisect_left(keys, prefix)
+		end = _prefix_end(prefix)
+		if end is None:
+			stop = len(keys)
+		else:
+			stop = bisect.bisect_left(keys, end, start)
+		return sums[stop] - sums[start]
+
 	def __nonzero__(self):
 		return self.count
 	def get_count(self):
@@ -103,7 +169,7 @@ def get_record_score(obj, key=u""):
 		return fav + 50 * (1 - 1.0/(cnt + 1))
 
 	stats = mns.get_mnemonics()
-	closescr = sum(stats[m] for m in stats if m.startswith(key))
+	closescr = mns.get_prefix_count(key)
 	mnscore = 30 * (1 - 1.0/(closescr + 1))
 	exact = stats.get(key, 0)
 	mnscore += 50 * (1 - 1.0/(exact + 1))
@@ -205,3 +271,7 @@ def remove_favorite(obj):
 
 def is_favorite(obj):
 	return repr(obj) in _favorites
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
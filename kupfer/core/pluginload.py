@@ -1,6 +1,9 @@
+from __future__ import with_statement
+
 import contextlib
 
 from kupfer import pretty
+from kupfer import tracing
 
 from kupfer.core import plugins
 from kupfer.core.plugins import (load_plugin_sources, sources_attribute,
@@ -20,15 +23,18 @@ def load_plugin(plugin_id):
 	@S_sources are to be included directly in the catalog,
 	@s_souces as just as subitems
 	"""
+	with tracing.span(plugin_id, "plugin load"):
+		return _load_plugin(plugin_id)
+
+def _load_plugin(item):
 	sources = []
 	text_sources = []
 	action_decorators = []
 	content_decorators = []
 	action_generators = []
 
-	item = plugin_id
-
-	initialize_plugin(item)
+	with tracing.span(item, "plugin initialize"):
+		initialize_plugin(item)
 	if not plugins.is_plugin_loaded(item):
 		return PluginDescription()
 	text_sources.extend(load_plugin_sources(item, text_sources_attribute))
@@ -53,6 +59,77 @@ def load_plugin(plugin_id):
 	desc.action_generators = action_generators
 	return desc
 
+def _type_name(typ):
+	return "%s.%s" % (typ.__module__, typ.__name__)
+
+def get_decorated_type_names(desc):
+	"""Return the names of the leaf types that the actions and
+	content decorators of PluginDescription @desc apply to
+
+	>>> from kupfer.obj import base, objects
+	>>> class Open (base.Action):
+	...     def item_types(self):
+	...         yield objects.FileLeaf
+	>>> class Contents (base.Source):
+	...     @classmethod
+	...     def decorates_type(cls):
+	...         return objects.AppLeaf
+	>>> desc = PluginDescription()
+	>>> desc.action_decorators = [Open(u"Open")]
+	>>> desc.content_decorators = [Contents, base.Source]
+	>>> get_decorated_type_names(desc)
+	('kupfer.obj.objects.AppLeaf', 'kupfer.obj.objects.FileLeaf')
+	"""
+	names = set()
+	for action in desc.action_decorators:
+		names.update(_type_name(t) for t in action.item_types())
+	for content in desc.content_decorators:
+		try:
+			names.add(_type_name(content.decorates_type()))
+		except AttributeError:
+			pass
+	return tuple(sorted(names))
+
+def get_type_names(leaf):
+	"""Return the set of names of the types of @leaf (and its members,
+	if it is a multiple leaf)
+
+	>>> from kupfer.obj import base, objects
+	>>> sorted(get_type_names(base.Leaf(1, u"One")))
+	['__builtin__.object', 'kupfer.obj.base.KupferObject', 'kupfer.obj.base.Leaf']
+	>>> class Several (base.Leaf):
+	...     def get_multiple_leaf_representation(self):
+	...         return self.object
+	>>> leaf = Several([objects.FileLeaf("/tmp")], u"Several")
+	>>> "kupfer.obj.objects.FileLeaf" in get_type_names(leaf)
+	True
+	"""
+	try:
+		members = list(leaf.get_multiple_leaf_representation())
+	except AttributeError:
+		members = []
+	names = set()
+	for obj in [leaf] + members:
+		names.update(_type_name(t) for t in type(obj).__mro__)
+	return names
+
+def get_deferred_types(plugin_id):
+	"""Return the names of the leaf types whose selection should load
+	@plugin_id, or None if it can't be deferred
+
+	Plugins are deferred if they only provide actions and content
+	decorators, need no initialization, and have been loaded before,
+	so that the types are known.
+	"""
+	info = plugins.get_indexed_attributes(plugin_id)
+	if not info:
+		return None
+	for attr in (sources_attribute, text_sources_attribute,
+			action_generators_attribute) + tuple(plugins.indexed_definitions):
+		if info.get(attr):
+			return None
+	return plugins.get_decorated_types(plugin_id)
+
 @contextlib.contextmanager
 def exception_guard(name, callback=None, *args):
 	"Guard for exceptions, print traceback and call @callback if any is raised"
@@ -69,3 +146,7 @@ def exception_guard(name, callback=None, *args):
 
 def remove_plugin(plugin_id):
 	plugins.unimport_plugin(plugin_id)
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
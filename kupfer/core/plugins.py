@@ -1,7 +1,15 @@
+from __future__ import with_statement
+
+import ast
+import cPickle as pickle
+import os
 import pkgutil
 import sys
 
+from kupfer import config
+from kupfer import conspickle
 from kupfer import pretty
+from kupfer import tracing
 from kupfer.core import settings
 # import kupfer.icons on demand later
 
@@ -57,15 +65,18 @@ def get_plugin_info():
 	description
 	author
 	"""
+	index = get_plugin_index()
 	for plugin_name in sorted(get_plugin_ids()):
-		try:
-			plugin = import_plugin_any(plugin_name)
-			if not plugin:
+		plugin = index.get(plugin_name)
+		if plugin is None:
+			try:
+				plugin = import_plugin_any(plugin_name)
+				if not plugin:
+					continue
+				plugin = vars(plugin)
+			except ImportError, e:
+				pretty.print_error(__name__, "import plugin '%s':" % plugin_name, e)
 				continue
-			plugin = vars(plugin)
-		except ImportError, e:
-			pretty.print_error(__name__, "import plugin '%s':" % plugin_name, e)
-			continue
 		localized_name = plugin.get("__kupfer_name__", None)
 		desc = plugin.get("__description__", "")
 		vers = plugin.get("__version__", "")
@@ -80,9 +91,237 @@ def get_plugin_info():
 			"version": vers,
 			"description": desc or u"",
 			"author": author,
-			"provides": (),
+			"provides": tuple(plugin.get(sources_attribute) or ()) +
+			            tuple(plugin.get(action_decorators_attribute) or ()),
 		}
 
+# Plugin Index
+#
+# The info attributes and the declared object names of plugins are read
+# from their source code, without importing them, and kept in a cache
+# file. Each plugin is read again when its file changes. The types of
+# leaves that a plugin's actions and contents apply to can only be known
+# by loading it; they are kept in the index too, once it has been loaded.
+
+PLUGIN_INDEX_VERSION = 2
+PLUGIN_INDEX_FILE = "plugin-index-v%d.pickle" % PLUGIN_INDEX_VERSION
+
+indexed_attributes = info_attributes + [
+		sources_attribute,
+		text_sources_attribute,
+		content_decorators_attribute,
+		action_decorators_attribute,
+		action_generators_attribute,
+	]
+
+# Names whose definition is recorded in the index as True
+indexed_definitions = [
+		initialize_attribute,
+		finalize_attribute,
+		settings_attribute,
+	]
+
+_plugin_index = None
+_plugin_index_changed = False
+
+def get_plugin_index():
+	"""Return a dict of plugin id -> dict of the indexed attributes of
+	the plugin, for the plugins whose attributes can be read from
+	their source code; their modules are not imported.
+	"""
+	index = {}
+	for plugin_id, entry in _get_plugin_index_entries().iteritems():
+		mtime, attributes, decorated_types = entry
+		if attributes is not None:
+			index[plugin_id] = _translate_attributes(attributes)
+	return index
+
+def get_indexed_attributes(plugin_id):
+	"""Return the dict of indexed attributes of @plugin_id,
+	or None if it is not in the index
+	"""
+	entry = _get_plugin_index_entries().get(plugin_id)
+	if entry and entry[1] is not None:
+		return _translate_attributes(entry[1])
+	return None
+
+def get_decorated_types(plugin_id):
+	"""Return the names of the leaf types that the actions and content
+	decorators of @plugin_id apply to, as recorded with
+	set_decorated_types, or None if not known for the current version
+	of the plugin
+	"""
+	entry = _get_plugin_index_entries().get(plugin_id)
+	return entry and entry[2]
+
+def set_decorated_types(plugin_id, type_names):
+	"""Record the names of the leaf types that the actions and content
+	decorators of @plugin_id apply to (until the plugin changes)
+	"""
+	global _plugin_index_changed
+	index = _get_plugin_index_entries()
+	if plugin_id in index and index[plugin_id][2] != type_names:
+		mtime, attributes, decorated_types = index[plugin_id]
+		index[plugin_id] = (mtime, attributes, type_names)
+		_plugin_index_changed = True
+
+def save_plugin_index():
+	"""Save the plugin index, if it changed"""
+	global _plugin_index_changed
+	index_file = _get_plugin_index_file()
+	if not (_plugin_index_changed and index_file):
+		return
+	try:
+		with open(index_file, "wb") as pfile:
+			pickle.dump(_plugin_index, pfile, pickle.HIGHEST_PROTOCOL)
+	except IOError, exc:
+		pretty.print_error(__name__, "Saving %s: %s" % (index_file, exc))
+	else:
+		pretty.print_debug(__name__, "Saved plugin index", index_file)
+		_plugin_index_changed = False
+
+def _get_plugin_index_entries():
+	global _plugin_index
+	if _plugin_index is None:
+		_plugin_index = _update_plugin_index()
+		save_plugin_index()
+	return _plugin_index
+
+def _get_plugin_index_file():
+	cache_home = config.get_cache_home()
+	return cache_home and os.path.join(cache_home, PLUGIN_INDEX_FILE)
+
+def _update_plugin_index():
+	"""Return the plugin index from file, updated for changed plugins
+
+	The index is a dict of plugin id ->
+	(mtime, attributes, decorated types), where attributes is None if
+	they can't be read without importing, and decorated types is None
+	until they are recorded.
+	"""
+	global _plugin_index_changed
+	index_file = _get_plugin_index_file()
+	index = {}
+	try:
+		with open(index_file, "rb") as pfile:
+			index = conspickle.BasicUnpickler.loads(pfile.read())
+	except (IOError, TypeError):
+		pass
+	except Exception, exc:
+		pretty.print_error(__name__, "Loading %s: %s" % (index_file, exc))
+	updated = {}
+	for plugin_id in get_plugin_ids():
+		modpath = ".".join(_plugin_path(plugin_id))
+		loader = pkgutil.get_loader(modpath)
+		mtime = loader and _get_loader_mtime(loader, modpath)
+		if mtime is not None and index.get(plugin_id, (None, ))[0] == mtime:
+			updated[plugin_id] = index[plugin_id]
+			continue
+		attributes = loader and _read_plugin_attributes(loader, modpath)
+		if mtime is not None:
+			updated[plugin_id] = (mtime, attributes, None)
+	if updated != index:
+		_plugin_index_changed = True
+	return updated
+
+def _get_loader_mtime(loader, modpath):
+	"""Return the mtime of the file (or zip archive) of a plugin"""
+	filenames = []
+	try:
+		filenames.append(loader.get_filename(modpath))
+	except (AttributeError, ImportError):
+		pass
+	filenames.append(getattr(loader, "archive", None))
+	for filename in filenames:
+		try:
+			return os.stat(filename).st_mtime
+		except (OSError, TypeError):
+			pass
+	return None
+
+class _NotIndexable (Exception):
+	pass
+
+def _read_plugin_attributes(loader, modpath):
+	"""Return a dict of the attributes of @modpath, read from its source
+
+	Each attribute is a (translatable, value) pair. Return None if an
+	attribute is not assigned a constant value at the top level, or
+	if the source can't be read.
+
+	>>> class Loader (object):
+	...     def __init__(self, source):
+	...         self.source = source
+	...     def get_source(self, modpath):
+	...         return self.source
+	>>> loader = Loader('__kupfer_name__ = _("Example")\\n'
+	...                 '__kupfer_actions__ = ("Open", )\\n'
+	...                 'def initialize_plugin(name):\\n'
+	...                 '    pass\\n')
+	>>> for item in sorted(_read_plugin_attributes(loader, "ex").items()):
+	...     print item
+	('__kupfer_actions__', (False, ('Open',)))
+	('__kupfer_name__', (True, 'Example'))
+	('initialize_plugin', (False, True))
+	>>> loader = Loader('__kupfer_name__ = _("Example")\\n'
+	...                 '__kupfer_sources__ = make_sources()\\n')
+	>>> print _read_plugin_attributes(loader, "ex")
+	None
+	"""
+	try:
+		source = loader.get_source(modpath)
+		tree = ast.parse(source)
+	except Exception, exc:
+		pretty.print_debug(__name__, "Can't index", modpath, exc)
+		return None
+	attributes = {}
+	try:
+		for node in tree.body:
+			for n in ast.walk(node):
+				if isinstance(n, ast.FunctionDef):
+					name = n.name
+				elif isinstance(n, ast.Name) and isinstance(n.ctx, ast.Store):
+					name = n.id
+				else:
+					continue
+				if name in indexed_definitions:
+					attributes[name] = (False, True)
+			assigned = [n.id for n in ast.walk(node) if
+			            isinstance(n, ast.Name) and isinstance(n.ctx, ast.Store)
+			            and n.id in indexed_attributes]
+			if not assigned:
+				continue
+			if not (isinstance(node, ast.Assign) and len(node.targets) == 1
+			        and isinstance(node.targets[0], ast.Name)):
+				raise _NotIndexable(assigned)
+			attributes[assigned[0]] = _constant_value(node.value)
+	except _NotIndexable, exc:
+		pretty.print_debug(__name__, "Can't index", modpath, exc)
+		return None
+	if "__kupfer_name__" not in attributes:
+		return None
+	return attributes
+
+def _constant_value(node):
+	"""Return (translatable, value) for expression @node, which is
+	a literal or a string literal marked for translation with _()
+	"""
+	if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and
+	    node.func.id == "_" and len(node.args) == 1 and
+	    isinstance(node.args[0], ast.Str) and not node.keywords and
+	    not node.starargs and not node.kwargs):
+		return (True, node.args[0].s)
+	try:
+		return (False, ast.literal_eval(node))
+	except ValueError:
+		raise _NotIndexable(ast.dump(node))
+
+def _translate_attributes(attributes):
+	translated = {}
+	for name, (translatable, value) in attributes.iteritems():
+		translated[name] = _(value) if translatable else value
+	return translated
+
 def get_plugin_desc():
 	"""Return a formatted list of plugins suitable for printing to terminal"""
 	import textwrap
@@ -260,7 +499,8 @@ def import_plugin(name):
 		return _imported_plugins[name]
 	plugin = None
 	try:
-		plugin = _import_plugin_true(name)
+		with tracing.span(name, "plugin import"):
+			plugin = _import_plugin_true(name)
 	except NotEnabledError:
 		plugin = _staged_import(name, _import_hook_fake)
 	finally:
@@ -415,3 +655,6 @@ def get_plugin_error(plugin_name):
 	except ImportError:
 		return sys.exc_info()
 
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
@@ -92,20 +92,34 @@ class qfurl (object):
 		qfid = qfid.lstrip("/")
 		return mother, qfid, typname
 
-	def resolve_in_catalog(self, catalog):
+	def may_be_provided_by(self, src):
+		"""Return False if @src does not provide the type of the object"""
+		mother, qfid, typname = self._parts_mother_id_typename(self.url)
+		if not typname:
+			return True
+		module, name = typname.rsplit(".", 1)
+		return (name in (pt.__name__ for pt in src.provides()) or
+		        name in (t.__name__ for pt in src.provides()
+		                 for t in pt.__subclasses__()))
+
+	def resolve_in_catalog(self, catalog, find_leaf=None):
 		"""Resolve self in a catalog of sources
 
-		Return *immediately* on match found"""
-		mother, qfid, typname = self._parts_mother_id_typename(self.url)
-		module, name = typname.rsplit(".", 1) if typname else (None, None)
+		Return *immediately* on match found
+
+		@find_leaf: if given, a function (source, url) returning the leaf
+		of source whose reduced qfurl is url, or None; else the leaves
+		of each source are compared one by one
+		"""
+		url = self.reduce_url(self.url)
 		for src in catalog:
-			if name:
-				if name not in (pt.__name__
-						for pt in src.provides()) and \
-					name not in (t.__name__
-						for pt in src.provides()
-						for t in pt.__subclasses__()):
-					continue
+			if not self.may_be_provided_by(src):
+				continue
+			if find_leaf is not None:
+				obj = find_leaf(src, url)
+				if obj is not None:
+					return obj
+				continue
 			for obj in src.get_leaves():
 				if not hasattr(obj, "qf_id"):
 					continue
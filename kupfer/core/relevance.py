@@ -33,6 +33,9 @@ Compatibility: Python 2.4 and later, including Python 3
 
 from __future__ import division
 
+import bisect
+import re
+
 # This module is compatible with both Python 2 and Python 3;
 # we need the iterator form of range for either version, stored in range()
 try:
@@ -109,11 +112,24 @@ def score(s, query):
     >>> print(score('terminal', ''))
     1.0
     """
+    return score_lowered(s.lower(), len(s), query)
+
+def score_lowered(ls, length, query, separators=None):
+    """
+    The relevancy score of a string, like score(), where the string is
+    given by its lowercase version @ls and its length @length
+
+    @separators: the sorted indices of word separators (" " and "-") in @ls,
+                 if they are already available
+
+    >>> score_lowered('big-data', 8, 'bd') == score('Big-Data', 'bd')
+    True
+    >>> score_lowered('big-data', 8, 'bd', [3]) == score('Big-Data', 'bd')
+    True
+    """
     if not query:
         return 1.0
 
-    ls = s.lower()
-
     # Find the shortest possible substring that matches the query
     # and get the ration of their lengths for a base score
     first, last = _findBestMatch(ls, query)
@@ -123,14 +139,16 @@ def score(s, query):
     score = len(query) / (last - first)
 
     # Now we weight by string length so shorter strings are better
-    score *= .7 + len(query) / len(s) * .3
+    score *= .7 + len(query) / length * .3
 
     # Bonus points if the characters start words
     good = 0
     bad = 1
     firstCount = 0
-    for i in range(first, last-1):
-        if ls[i] in " -":
+    if separators is None:
+        separators = (i for i in range(first, last-1) if ls[i] in " -")
+    for i in separators:
+        if first <= i < last-1:
             if ls[i + 1] in query:
                 firstCount += 1
             else:
@@ -164,6 +182,82 @@ def score(s, query):
     
     return score
 
+# Below this many strings, the regex prefilter in score_batch is not worth
+# packing the strings for
+BATCH_PREFILTER_MIN = 50
+
+def score_batch(lowered, query, lengths=None, separators=None):
+    """
+    Relevancy scores for each of the lowercased strings in @lowered
+
+    @lowered: a sequence of strings, already lowercased
+    @query: a string query to score against
+    @lengths: the lengths of the original strings, if they differ from
+              the lowercased strings' lengths
+    @separators: the word separator indices of each string, see
+                 score_lowered()
+
+    The strings are joined into one buffer and a compiled regular expression
+    finds those containing the query in order; only those are scored.
+
+    Returns: a list of floats, identical to [score(s, query) ...]
+
+    >>> names = ['terminal', 'trash', 'xterm']
+    >>> score_batch(names, 'trm') == [score(s, 'trm') for s in names]
+    True
+    >>> score_batch(names * 20, 'trm')[-3:] == score_batch(names, 'trm')
+    True
+    >>> print(score_batch(['terminal', 'trash'], ''))
+    [1.0, 1.0]
+    """
+    if lengths is None:
+        lengths = [len(ls) for ls in lowered]
+    if not query:
+        return [1.0] * len(lowered)
+    if separators is None:
+        separators = [None] * len(lowered)
+    scores = [0.0] * len(lowered)
+    for idx in _batch_candidates(lowered, query):
+        scores[idx] = score_lowered(lowered[idx], lengths[idx], query,
+                                    separators[idx])
+    return scores
+
+def _batch_candidates(lowered, query):
+    """
+    Return an iterable of the indices of the strings in @lowered
+    that may contain @query in order
+    """
+    if len(lowered) < BATCH_PREFILTER_MIN or "\n" in query:
+        return range(len(lowered))
+    buf = "\n".join(lowered)
+    if buf.count("\n") != len(lowered) - 1:
+        return range(len(lowered))
+    # Each gap skips to the next occurrence of the following character,
+    # and never past the end of the line
+    parts = [re.escape(query[0])]
+    for char in query[1:]:
+        char = re.escape(char)
+        parts.append("[^\n%s]*%s" % (char, char))
+    pattern = re.compile("".join(parts))
+    return _regex_candidates(pattern, buf, lowered)
+
+def _regex_candidates(pattern, buf, lowered):
+    starts = []
+    offset = 0
+    for ls in lowered:
+        starts.append(offset)
+        offset += len(ls) + 1
+    pos = 0
+    while True:
+        match = pattern.search(buf, pos)
+        if match is None:
+            return
+        idx = bisect.bisect_right(starts, match.start()) - 1
+        yield idx
+        if idx + 1 == len(starts):
+            return
+        pos = starts[idx + 1]
+
 def _findBestMatch(s, query):
     """
     Finds the shortest substring of @s that contains all characters of query
@@ -1,5 +1,7 @@
 # -*- coding: UTF-8 -*-
 
+import itertools
+
 from kupfer.core import learn, relevance
 
 def make_rankables(itr, rank=0):
@@ -74,6 +76,46 @@ def score_objects(rankables, key):
 			rb.rank = rank
 			yield rb
 
+def score_indexed(index, positions, key):
+	"""Score the leaves at @positions in the SourceIndex @index for @key
+
+	This is equivalent to score_objects, but scores the names in one batch.
+	Return a list of (position, rank, alias or None) for the leaves that
+	pass with a >0 rank, where the alias is given if it ranked better
+	than the name.
+	"""
+	_score = relevance.score_lowered
+	key = key.lower()
+	values = index.values
+	lowered = index.lowered
+	get_separators = index.get_separators
+	scores = relevance.score_batch([lowered[pos] for pos in positions], key,
+	                               [len(values[pos]) for pos in positions],
+	                               [get_separators(pos) for pos in positions])
+	aliases = index.aliases
+	lowered_aliases = index.lowered_aliases
+	scored = []
+	for pos, score in itertools.izip(positions, scores):
+		rank = score*100
+		value = None
+		if rank < 90:
+			for alias, lalias in itertools.izip(aliases[pos],
+			                                    lowered_aliases[pos]):
+				arank = _score(lalias, len(alias), key)*95
+				if arank > rank:
+					rank = arank
+					value = alias
+		if rank:
+			scored.append((pos, rank, value))
+	return scored
+
+def make_indexed_rankables(index, scored):
+	"""Return Rankables for the (position, rank, alias or None) entries
+	in @scored, for leaves of the SourceIndex @index"""
+	values = index.values
+	leaves = index.leaves
+	return [Rankable(alias or values[pos], leaves[pos], rank)
+	        for pos, rank, alias in scored]
 
 def score_actions(rankables, for_leaf):
 	"""Alternative (rigid) scoring mechanism for objects,
@@ -0,0 +1,92 @@
+"""
+Run searches in a background thread, so that the main loop
+stays responsive while a large catalog is ranked.
+
+Searches are submitted on a channel (for example a pane); only the most
+recent search of each channel is run, and a search is cancelled as soon
+as a newer one is submitted on its channel. Each search gets a sequence
+number, and results are only delivered (in the main loop) if no newer
+search was submitted meanwhile, so results never arrive out of order.
+"""
+
+from __future__ import with_statement
+
+import threading
+
+import gobject
+
+from kupfer import pretty
+
+class SearchWorker (pretty.OutputMixin):
+	def __init__(self):
+		self._cond = threading.Condition()
+		self._pending = {}
+		self._latest = {}
+		self._sequence = 0
+		self._thread = None
+
+	def submit(self, channel, job, callback):
+		"""
+		Run @job in the worker thread and then @callback(result) in the
+		main loop, unless a newer search is submitted on @channel
+
+		@job is called with one argument, a function that returns
+		True if the search is stale; then the job should return early.
+
+		Return the sequence number of the search
+		"""
+		with self._cond:
+			self._sequence += 1
+			seq = self._sequence
+			self._latest[channel] = seq
+			self._pending[channel] = (seq, job, callback)
+			self._cond.notify()
+		if self._thread is None:
+			self._thread = threading.Thread(target=self._run,
+					name="SearchWorker")
+			self._thread.setDaemon(True)
+			self._thread.start()
+		return seq
+
+	def cancel(self, channel):
+		"""Cancel the outstanding search on @channel"""
+		with self._cond:
+			self._sequence += 1
+			self._latest[channel] = self._sequence
+			self._pending.pop(channel, None)
+
+	def is_stale(self, channel, seq):
+		return self._latest.get(channel) != seq
+
+	def _next_job(self):
+		with self._cond:
+			while not self._pending:
+				self._cond.wait()
+			channel = min(self._pending, key=lambda c: self._pending[c][0])
+			return (channel, ) + self._pending.pop(channel)
+
+	def _run(self):
+		while True:
+			channel, seq, job, callback = self._next_job()
+			is_stale = lambda: self.is_stale(channel, seq)
+			try:
+				result = job(is_stale)
+			except Exception:
+				self.output_exc()
+				continue
+			if not is_stale():
+				gobject.idle_add(self._deliver, channel, seq, callback, result)
+
+	def _deliver(self, channel, seq, callback, result):
+		if self.is_stale(channel, seq):
+			self.output_debug("Dropping stale search", seq)
+		else:
+			callback(result)
+		return False
+
+_search_worker = None
+def GetSearchWorker():
+	global _search_worker
+	if _search_worker is None:
+		_search_worker = SearchWorker()
+	return _search_worker
@@ -35,6 +35,9 @@ class SettingsController (gobject.GObject, pretty.OutputMixin):
 			"magickeybinding": "",
 			"showstatusicon" : True,
 			"usecommandkeys" : True,
+			"backgroundsearch" : False,
+			"progressivesearch" : False,
+			"deferplugins" : False,
 		},
 		"Directories" : { "direct" : default_directories, "catalog" : (), },
 		"DeepDirectories" : { "direct" : (), "catalog" : (), "depth" : 1, },
@@ -291,6 +294,18 @@ class SettingsController (gobject.GObject, pretty.OutputMixin):
 	def set_use_command_keys(self, enabled):
 		return self._set_config("Kupfer", "usecommandkeys", enabled)
 
+	def get_background_search(self):
+		"""Convenience: Rank searches in a background thread, as bool"""
+		return strbool(self.get_config("Kupfer", "backgroundsearch"))
+
+	def get_progressive_search(self):
+		"""Convenience: Show the result of fast sources first, as bool"""
+		return strbool(self.get_config("Kupfer", "progressivesearch"))
+
+	def get_defer_plugins(self):
+		"""Convenience: Load plugins with only actions when needed, as bool"""
+		return strbool(self.get_config("Kupfer", "deferplugins"))
+
 	def get_show_status_icon(self):
 		"""Convenience: Show icon in notification area as bool"""
 		return strbool(self.get_config("Kupfer", "showstatusicon"))
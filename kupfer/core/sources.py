@@ -1,19 +1,33 @@
 from __future__ import with_statement
 
-import gzip
+import collections
+import functools
 import hashlib
 import itertools
 import cPickle as pickle
 import os
+import sys
 import threading
 import time
 import weakref
 
+import gobject
+
 from kupfer import config, pretty, scheduler
 from kupfer import conspickle
+from kupfer import tracing
 from kupfer.obj import base, sources
+from kupfer.obj.helplib import FilesystemWatchMixin
+from kupfer.core import catalogindex
+from kupfer.core import catalogsnapshot
 from kupfer.core import pluginload
 
+# Keep at most this many leaves of sources in memory, see spill_sources;
+# this is checked when data is saved (hourly), not on memory pressure
+SPILL_MAX_LEAVES = 100000
+# Spill the leaves of sources that were not used for this many seconds
+SPILL_MIN_IDLE = 600
+
 class InternalError (Exception):
 	pass
 
@@ -26,15 +40,23 @@ class PeriodicRescanner (pretty.OutputMixin):
 
 	Each campaign of rescans is separarated by @campaign
 	seconds
+
+	Sources that watch the filesystem are updated by events, and
+	are only rescanned every @watched_interval seconds.
+	Rescans run in the worker threads of @loader.
 	"""
-	def __init__(self, period=5, startup=10, campaign=3600):
+	def __init__(self, period=5, startup=10, campaign=3600,
+			watched_interval=6*3600, loader=None):
 		self.startup = startup
 		self.period = period
 		self.campaign=campaign
 		self.timer = scheduler.Timer()
+		self.loader = loader or SourceLoader()
 		# Source -> time mapping
 		self.latest_rescan_time = weakref.WeakKeyDictionary()
 		self._min_rescan_interval = campaign//4
+		self._watched_rescan_interval = watched_interval
+		self._rescanning = set()
 
 	def set_catalog(self, catalog):
 		self.catalog = catalog
@@ -51,7 +73,7 @@ class PeriodicRescanner (pretty.OutputMixin):
 		# Advance until we find a source that was not recently rescanned
 		for next in self.cur:
 			oldtime = self.latest_rescan_time.get(next, 0)
-			if (time.time() - oldtime) > self._min_rescan_interval:
+			if (time.time() - oldtime) > self._rescan_interval(next):
 				self.timer.set(self.period, self._periodic_rescan_helper)
 				self._start_source_rescan(next)
 				return
@@ -59,6 +81,11 @@ class PeriodicRescanner (pretty.OutputMixin):
 		self.output_info("Campaign finished, pausing %d s" % self.campaign)
 		self.timer.set(self.campaign, self._new_campaign)
 
+	def _rescan_interval(self, source):
+		if isinstance(source, FilesystemWatchMixin):
+			return self._watched_rescan_interval
+		return self._min_rescan_interval
+
 	def rescan_now(self, source, force_update=False):
 		"Rescan @source immediately"
 		if force_update:
@@ -68,23 +95,122 @@ class PeriodicRescanner (pretty.OutputMixin):
 
 	def _start_source_rescan(self, source):
 		self.latest_rescan_time[source] = time.time()
-		if not source.is_dynamic():
-			thread = threading.Thread(target=self.rescan_source, args=(source,))
-			thread.setDaemon(True)
-			thread.start()
+		if not source.is_dynamic() and source not in self._rescanning:
+			self._rescanning.add(source)
+			source.set_loading(True)
+			self.loader.submit(source, self.rescan_source, self._rescan_done,
+					"rescan")
+
+	def _rescan_done(self, source, result, exc_info, duration):
+		self._rescanning.discard(source)
+		source.set_loading(False)
+		if exc_info is not None:
+			self.output_error("Rescanning %s: %s" % (source, exc_info[1]))
+		else:
+			self.output_debug("Rescanned %s in %.3f s" % (source, duration))
 
 	def rescan_source(self, source, force_update=True):
 		list(source.get_leaves(force_update=force_update))
 
+class SourceLoader (pretty.OutputMixin):
+	"""
+	Run jobs on sources in a pool of at most @workers threads
+
+	Jobs on independent sources run concurrently, so that one slow
+	source does not hold up the others. The threads exit when
+	there are no more jobs.
+	"""
+	def __init__(self, workers=4):
+		self.workers = workers
+		self._lock = threading.Lock()
+		self._jobs = collections.deque()
+		self._num_threads = 0
+		self._thread_ids = itertools.count(1)
+
+	def submit(self, source, job, callback, step="job"):
+		"""
+		Run @job(@source) in a worker thread, and then
+		@callback(source, result, exc_info, duration) in the main loop
+
+		@exc_info is None if the job succeeded, @duration is the time
+		the job took in seconds. The job is traced as @step.
+		"""
+		def deliver(*args):
+			gobject.idle_add(callback, *args)
+		self._put(source, job, deliver, step)
+
+	def map(self, sources, job, step="job"):
+		"""
+		Run @job on each of @sources in the worker threads, wait until
+		all are done and return a list of (source, result, exc_info,
+		duration) in the order of @sources
+		"""
+		sources = list(sources)
+		results = [None] * len(sources)
+		remaining = [len(sources)]
+		done = threading.Condition()
+		def finish(idx, *args):
+			with done:
+				results[idx] = args
+				remaining[0] -= 1
+				done.notify()
+		for idx, source in enumerate(sources):
+			self._put(source, job, functools.partial(finish, idx), step)
+		with done:
+			while remaining[0]:
+				done.wait()
+		return results
+
+	def _put(self, source, job, deliver, step):
+		with self._lock:
+			self._jobs.append((source, job, deliver, step))
+			if self._num_threads >= self.workers:
+				return
+			self._num_threads += 1
+			name = "SourceLoader-%d" % self._thread_ids.next()
+		thread = threading.Thread(target=self._run, name=name)
+		thread.setDaemon(True)
+		thread.start()
+
+	def _run(self):
+		while True:
+			with self._lock:
+				if not self._jobs:
+					self._num_threads -= 1
+					return
+				source, job, deliver, step = self._jobs.popleft()
+			start = time.time()
+			try:
+				result, exc_info = job(source), None
+			except Exception:
+				result, exc_info = None, sys.exc_info()
+			duration = time.time() - start
+			tracing.add_span(unicode(source), "source " + step, start, duration)
+			deliver(source, result, exc_info, duration)
+
 class SourcePickler (pretty.OutputMixin):
 	"""
 	Takes care of pickling and unpickling Kupfer Sources.
-	"""
-	pickle_version = 4
-	name_template = "k%s-v%d.pickle.gz"
 
-	def __init__(self):
-		self.open = lambda f,mode: gzip.open(f, mode, compresslevel=3)
+	All sources are stored in one catalog snapshot file; see
+	kupfer.core.catalogsnapshot
+
+	Only sources whose leaves changed since they were restored or
+	stored are written; they are appended to the snapshot, which is
+	rewritten when more than half of it is replaced data.
+	"""
+	pickle_version = 7
+	name_template = "catalog-v%d.snapshot"
+	# Old cache files are named after this pattern
+	obsolete_template = "k%s-v%d.pickle.gz"
+
+	# The open snapshot, shared by all picklers
+	_snapshot = None
+	# key -> (weakref to source, generation, id of cached items) for
+	# the sources as they are in the snapshot
+	_stored = {}
+	# keys of sections whose leaves could not be loaded
+	_discarded = set()
 
 	def should_use_cache(self):
 		return config.has_capability("CACHE")
@@ -93,16 +219,18 @@ class SourcePickler (pretty.OutputMixin):
 		"""Checks if there are old cachefiles from last version,
 		and deletes those
 		"""
-		for dpath, dirs, files in os.walk(config.get_cache_home()):
-			# Look for files matching beginning and end of
-			# name_template, with the previous file version
-			chead, ctail = self.name_template.split("%s")
-			ctail = ctail % ((self.pickle_version -1),)
-			obsolete_files = []
-			for cfile in files:
-				if cfile.startswith(chead) and cfile.endswith(ctail):
-					cfullpath = os.path.join(dpath, cfile)
-					obsolete_files.append(cfullpath)
+		current = os.path.basename(self.get_filename())
+		chead, ctail = self.obsolete_template.split("%s")
+		ctail = ctail.split("%d")[-1]
+		shead, stail = self.name_template.split("%d")
+		obsolete_files = []
+		cache_home = config.get_cache_home()
+		# Look for per-source files, and snapshots of other versions
+		for cfile in os.listdir(cache_home):
+			if ((cfile.startswith(chead) and cfile.endswith(ctail)) or
+			    (cfile.startswith(shead) and cfile.endswith(stail) and
+			     cfile != current)):
+				obsolete_files.append(os.path.join(cache_home, cfile))
 		if obsolete_files:
 			self.output_info("Removing obsolete cache files:", sep="\n",
 					*obsolete_files)
@@ -112,63 +240,181 @@ class SourcePickler (pretty.OutputMixin):
 				assert "kupfer" in fpath
 				os.unlink(fpath)
 
-	def get_filename(self, source):
-		"""Return cache filename for @source"""
+	def get_filename(self):
+		"""Return the snapshot filename"""
+		filename = self.name_template % (self.pickle_version, )
+		return os.path.join(config.get_cache_home(), filename)
+
+	def get_key(self, source):
+		"""Return the key of @source in the snapshot"""
 		# make sure we take the source name into account
 		# so that we get a "break" when locale changes
 		source_id = "%s%s%s" % (repr(source), str(source), source.version)
-		bytes = hashlib.md5(source_id).digest()
-		hashstr = bytes.encode("base64").rstrip("\n=").replace("/", "-")
-		filename = self.name_template % (hashstr, self.pickle_version)
-		return os.path.join(config.get_cache_home(), filename)
+		return hashlib.md5(source_id).digest()
+
+	def _get_snapshot(self):
+		"""Return the open snapshot, or None"""
+		path = self.get_filename()
+		try:
+			stat = os.stat(path)
+		except OSError:
+			return None
+		snapshot = SourcePickler._snapshot
+		if snapshot is not None:
+			old = snapshot.stat
+			if (old.st_ino, old.st_mtime, old.st_size) == \
+			   (stat.st_ino, stat.st_mtime, stat.st_size):
+				return snapshot
+		try:
+			snapshot = catalogsnapshot.CatalogSnapshot(path)
+		except (EnvironmentError, catalogsnapshot.SnapshotError), e:
+			self.output_info("Error loading %s: %s" % (path, e))
+			snapshot = None
+		SourcePickler._snapshot = snapshot
+		return snapshot
+
+	def _set_stored(self, key, source):
+		"Remember that @source is in the snapshot as it is now"
+		SourcePickler._stored[key] = (weakref.ref(source),
+		                              source.get_generation(),
+		                              id(source.cached_items))
+
+	def _is_stored(self, snapshot, key, source):
+		"""Return True if @source is in @snapshot as it is now: it was
+		stored or restored, and its cached items were not set since"""
+		if key not in snapshot:
+			return False
+		ref, generation, items_id = \
+				SourcePickler._stored.get(key, (None, None, None))
+		return (ref is not None and ref() is source and
+		        generation == source.get_generation() and
+		        items_id == id(source.cached_items))
 
 	def unpickle_source(self, source):
 		if not self.should_use_cache():
 			return None
 
-		cached = self._unpickle_source(self.get_filename(source))
-		if not cached:
+		snapshot = self._get_snapshot()
+		key = self.get_key(source)
+		if snapshot is None or key not in snapshot or key in self._discarded:
+			return None
+		try:
+			cached = snapshot.load_source(key)
+			assert isinstance(cached, base.Source), "Stored object not a Source"
+			self.output_debug("Loading", cached, "from snapshot")
+		except (pickle.PickleError, Exception), e:
+			self.output_info("Error loading %s: %s" % (source, e))
 			return None
+		if isinstance(cached.cached_items, catalogsnapshot.LazyLeaves):
+			cached.cached_items.on_load_error = self._leaves_failed
 
 		# check consistency
 		if source == cached:
+			self._set_stored(key, cached)
 			return cached
 		else:
 			self.output_debug("Cached version mismatches", source)
 		return None
-	def _unpickle_source(self, pickle_file):
-		try:
-			pfile = self.open(pickle_file, "rb")
-		except IOError, e:
-			return None
-		try:
-			source = pickle.loads(pfile.read())
-			assert isinstance(source, base.Source), "Stored object not a Source"
-			sname = os.path.basename
-			self.output_debug("Loading", source, "from", sname(pickle_file))
-		except (pickle.PickleError, Exception), e:
-			source = None
-			self.output_info("Error loading %s: %s" % (pickle_file, e))
-		return source
 
 	def pickle_source(self, source):
+		return self.pickle_sources((source, ))
+
+	def pickle_sources(self, sources):
+		"""Store @sources in the snapshot, keeping the other sources
+		that are stored there"""
 		if not self.should_use_cache():
 			return None
-		return self._pickle_source(self.get_filename(source), source)
-	def _pickle_source(self, pickle_file, source):
-		"""
-		When writing to a file, use pickle.dumps()
-		and then write the file in one go --
-		if the file is a gzip file, pickler's thousands
-		of small writes are very slow
+		snapshot = self._get_snapshot()
+		changed = {}
+		stored = []
+		for source in sources:
+			key = self.get_key(source)
+			if snapshot is not None and self._is_stored(snapshot, key, source):
+				continue
+			try:
+				section = catalogsnapshot.make_section(source)
+			except (pickle.PickleError, Exception), e:
+				self.output_error("Unable to store %s: %s" % (source, e))
+				continue
+			if (snapshot is not None and key in snapshot and
+			    key not in self._discarded and
+			    section[1] == snapshot.get_fingerprint(key)):
+				# rescanned, but the same as stored
+				self._set_stored(key, source)
+				continue
+			self.output_debug("Storing", source)
+			changed[key] = section
+			stored.append((key, source))
+		path = self.get_filename()
+		if snapshot is not None and not changed:
+			self.output_debug("Snapshot is up to date")
+			return True
+		if snapshot is not None and snapshot.wasted_size() <= snapshot.live_size:
+			catalogsnapshot.append_snapshot(snapshot, changed)
+			self.output_debug("Appended %d sources to snapshot" % len(changed))
+		else:
+			sections = {}
+			if snapshot is not None:
+				for key in snapshot.keys():
+					if key not in self._discarded:
+						sections[key] = snapshot.get_section(key)
+			sections.update(changed)
+			catalogsnapshot.write_snapshot(path, sections)
+			self.output_debug("Stored snapshot", os.path.basename(path))
+		for key, source in stored:
+			self._set_stored(key, source)
+			SourcePickler._discarded.discard(key)
+		return True
+
+	def spill_source(self, source):
+		"""Store @source in the snapshot if needed, and replace its
+		cached leaves by leaves loaded lazily from the snapshot
+
+		Sources are normally stored after they are finalized; a source
+		that implements finalize is not spilled, since its stored state
+		could depend on it.
+
+		Return True if successful
 		"""
-		output = self.open(pickle_file, "wb")
-		sname = os.path.basename
-		self.output_debug("Storing", source, "as", sname(pickle_file))
-		output.write(pickle.dumps(source, pickle.HIGHEST_PROTOCOL))
-		output.close()
+		if not self.should_use_cache():
+			return False
+		if type(source).finalize.im_func is not base.Source.finalize.im_func:
+			return False
+		key = self.get_key(source)
+		snapshot = self._get_snapshot()
+		if snapshot is None or not self._is_stored(snapshot, key, source):
+			self.pickle_sources((source, ))
+			snapshot = self._get_snapshot()
+			if snapshot is None or not self._is_stored(snapshot, key, source):
+				return False
+		try:
+			leaves = snapshot.load_leaves(key, source)
+		except (pickle.PickleError, Exception), e:
+			self.output_info("Error loading %s: %s" % (source, e))
+			return False
+		leaves.on_load_error = self._leaves_failed
+		source.set_cached_items(leaves)
+		self._set_stored(key, source)
 		return True
 
+	@classmethod
+	def _leaves_failed(cls, leaves):
+		"""Called, in any thread, when some of the LazyLeaves @leaves
+		could not be loaded from the snapshot"""
+		gobject.idle_add(cls._discard_section, leaves)
+
+	@classmethod
+	def _discard_section(cls, leaves):
+		"""Drop the snapshot section of the source of @leaves, which
+		can't be loaded, and load the source's leaves again"""
+		source = leaves.source
+		key = cls().get_key(source)
+		cls._stored.pop(key, None)
+		cls._discarded.add(key)
+		if source.cached_items is leaves:
+			GetSourceController().reload_source(source)
+		return False
+
 class SourceDataPickler (pretty.OutputMixin):
 	""" Takes care of pickling and unpickling Kupfer Sources' configuration
 	or data.
@@ -203,6 +449,10 @@ class SourceDataPickler (pretty.OutputMixin):
 
 	def load_source(self, source):
 		data = self._load_data(self.get_filename(source))
+		return self.restore_source(source, data)
+
+	def restore_source(self, source, data):
+		"Apply the configuration @data, as loaded, to @source"
 		if not data:
 			return True
 		source.config_restore(data)
@@ -251,9 +501,18 @@ class SourceController (pretty.OutputMixin):
 
 	Call .add() to add sources.
 	Call .initialize() before use commences.
+
+	Sources are restored from cache and rescanned by pools of worker
+	threads; .load_timings maps each source to the time in seconds
+	each step took for it ("restore", "initialize", "cache").
 	"""
 	def __init__(self):
-		self.rescanner = PeriodicRescanner(period=3)
+		self.loader = SourceLoader()
+		# Restores are waited for, so they don't share the pool with
+		# rescans, which may take long
+		self.restore_loader = SourceLoader()
+		self.rescanner = PeriodicRescanner(period=3, loader=self.loader)
+		self.load_timings = weakref.WeakKeyDictionary()
 		self.sources = set()
 		self.toplevel_sources = set()
 		self.text_sources = set()
@@ -261,14 +520,31 @@ class SourceController (pretty.OutputMixin):
 		self.action_decorators = {}
 		self.action_generators = []
 		self.plugin_object_map = weakref.WeakKeyDictionary()
+		# id(source) -> (weakref to source, generation, leaves,
+		#                leaf id -> position in leaves)
+		self._leaf_index = {}
 		self.loaded_successfully = False
 		self.did_finalize_sources = False
 		self._pre_root = None
+		# types -> catalog of root_for_types
+		self._typed_roots = {}
+		# (sources providing any type, type -> sources providing it)
+		self._providers = None
+		# Sources added but not yet restored
+		self._unrestored = set()
+		# Sources being cached by the loader
+		self._loading = set()
+		self._load_start = None
 
 	def add(self, plugin_id, srcs, toplevel=False, initialize=False):
 		self._invalidate_root()
-		sources = set(self._try_restore(srcs))
-		sources.update(srcs)
+		if initialize:
+			sources = set(self._try_restore(srcs))
+			sources.update(srcs)
+		else:
+			# restored together with all others in .initialize()
+			sources = set(srcs)
+			self._unrestored.update(sources)
 
 		self.sources.update(sources)
 		if toplevel:
@@ -294,12 +570,28 @@ class SourceController (pretty.OutputMixin):
 			self.plugin_object_map[obj] = plugin_id
 			pretty.print_debug(__name__, "Add", repr(obj))
 
+	def _replace(self, src):
+		"Track @src instead of the equal instance that was added"
+		self._invalidate_root()
+		self.sources.discard(src)
+		self.sources.add(src)
+		if src in self.toplevel_sources:
+			self.toplevel_sources.discard(src)
+			self.toplevel_sources.add(src)
+		plugin_id = self.plugin_object_map.pop(src, None)
+		if plugin_id is not None:
+			self.plugin_object_map[src] = plugin_id
+		# the replaced instance may be indexed
+		self._leaf_index.clear()
+
 	def _remove(self, src):
 		self._invalidate_root()
 		self.toplevel_sources.discard(src)
 		self.sources.discard(src)
+		self._unrestored.discard(src)
 		self.rescanner.set_catalog(self.sources)
 		self._finalize_source(src)
+		self._leaf_index.pop(id(src), None)
 		pretty.print_debug(__name__, "Remove", repr(src))
 
 	def get_plugin_id_for_object(self, obj):
@@ -405,6 +697,8 @@ class SourceController (pretty.OutputMixin):
 	def _invalidate_root(self):
 		"The source root needs to be recalculated"
 		self._pre_root = None
+		self._typed_roots.clear()
+		self._providers = None
 
 	@property
 	def _firstlevel(self):
@@ -432,6 +726,21 @@ class SourceController (pretty.OutputMixin):
 			if issubclass(t, types):
 				return True
 
+	def _get_providers(self):
+		"""Return (sources providing any type, type -> set of sources
+		providing it), computed once until the sources change"""
+		if self._providers is None:
+			any_type = set()
+			providers = {}
+			for src in self.sources:
+				provides = list(src.provides())
+				if not provides:
+					any_type.add(src)
+				for typ in provides:
+					providers.setdefault(typ, set()).add(src)
+			self._providers = (any_type, providers)
+		return self._providers
+
 	def root_for_types(self, types):
 		"""
 		Get root for a flat catalog of all catalogs
@@ -440,16 +749,88 @@ class SourceController (pretty.OutputMixin):
 		Take all sources which:
 			Provide a type T so that it is a subclass
 			to one in the set of types we want
+
+		The catalog is kept until the sources change.
 		"""
 		types = tuple(types)
-		firstlevel = set()
+		if types in self._typed_roots:
+			return self._typed_roots[types]
+		any_type, providers = self._get_providers()
+		firstlevel = set(any_type)
+		for typ, srcs in providers.iteritems():
+			if issubclass(typ, types):
+				firstlevel.update(srcs)
 		# include the Catalog index since we want to include
 		# the top of the catalogs (like $HOME)
-		catalog_index = (sources.SourcesSource(self.sources), )
-		for s in itertools.chain(self.sources, catalog_index):
-			if self.good_source_for_types(s, types):
-				firstlevel.add(s)
-		return sources.MultiSource(firstlevel)
+		catalog_index = sources.SourcesSource(self.sources)
+		if self.good_source_for_types(catalog_index, types):
+			firstlevel.add(catalog_index)
+		root = sources.MultiSource(firstlevel)
+		self._typed_roots[types] = root
+		return root
+
+	def find_leaf(self, source, leaf_id):
+		"""
+		Return the first leaf of @source whose repr, or reduced qfurl,
+		is @leaf_id, or None
+
+		The ids of the leaves of each source are indexed, and the
+		index is rebuilt when the cached items of the source change.
+		Leaves restored from the snapshot are indexed by the ids stored
+		with them, without loading them.
+
+		>>> class Source (base.Source):
+		...     def get_items(self):
+		...         return [base.Leaf(1, u"One"), base.Leaf(2, u"Two")]
+		>>> src = Source(u"Numbers")
+		>>> sc = SourceController()
+		>>> sc.find_leaf(src, repr(base.Leaf(2, u"Two"))).object
+		2
+		>>> sc.find_leaf(src, "<Leaf Three>") is None
+		True
+		>>> src.mark_for_update()
+		>>> sc.find_leaf(src, repr(base.Leaf(1, u"One"))).object
+		1
+
+		Sources may cache their leaves as they are generated:
+
+		>>> class Generator (base.Source):
+		...     def get_items(self):
+		...         yield base.Leaf(1, u"One")
+		...         yield base.Leaf(2, u"Two")
+		>>> src = Generator(u"Generated")
+		>>> sc.find_leaf(src, repr(base.Leaf(2, u"Two"))).object
+		2
+		"""
+		if source.is_dynamic():
+			for leaf in source.get_leaves():
+				if leaf_id in catalogsnapshot.leaf_ids(leaf):
+					return leaf
+			return None
+		entry = self._leaf_index.get(id(source))
+		if (entry is None or entry[0]() is not source or
+		    entry[1] != source.get_generation()):
+			index = {}
+			leaves = source.get_leaves()
+			if isinstance(leaves, catalogsnapshot.LazyLeaves):
+				all_ids = leaves.get_ids()
+			else:
+				if not isinstance(leaves, (list, tuple)):
+					leaves = list(leaves)
+				all_ids = (catalogsnapshot.leaf_ids(l) for l in leaves)
+			for idx, ids in enumerate(all_ids):
+				for id_ in ids:
+					index.setdefault(id_, idx)
+			entry = (weakref.ref(source), source.get_generation(), leaves,
+			         index)
+			self._leaf_index[id(source)] = entry
+		idx = entry[3].get(leaf_id)
+		if idx is None:
+			return None
+		leaf = entry[2][idx]
+		if isinstance(leaf, catalogsnapshot.UnloadableLeaf):
+			return None
+		return leaf
 
 	def get_canonical_source(self, source):
 		"Return the canonical instance for @source"
@@ -503,10 +884,58 @@ class SourceController (pretty.OutputMixin):
 		if not self.did_finalize_sources:
 			raise InternalError("Called save_cache without finalize!")
 		if self.loaded_successfully:
-			self._pickle_sources(self.sources)
+			# sources still being cached keep their previous cache
+			self._pickle_sources(self.sources - self._loading)
 		else:
 			self.output_debug("Not writing cache on failed load")
 
+	def spill_sources(self, max_leaves=SPILL_MAX_LEAVES,
+			min_idle=SPILL_MIN_IDLE):
+		"""
+		Move the cached leaves of the least recently used sources to the
+		snapshot on disk, until at most @max_leaves leaves are in memory
+
+		Only sources that were not used for @min_idle seconds are moved;
+		their leaves are loaded again one by one when accessed.
+		Return the number of sources moved.
+
+		This is called when data is saved, so memory is bounded only
+		as often as that; it does not respond to memory pressure.
+		"""
+		if not self.loaded_successfully:
+			return 0
+		candidates = []
+		in_memory = 0
+		for src in self.sources:
+			items = src.cached_items
+			if isinstance(items, catalogsnapshot.LazyLeaves):
+				count = items.loaded_count()
+			elif catalogindex.is_complete(items) and not src.is_dynamic():
+				count = len(getattr(items, "data", items))
+			else:
+				continue
+			in_memory += count
+			if (count and src not in self._loading and
+			    not SourceDataPickler.source_has_config(src) and
+			    time.time() - src.get_last_used() > min_idle):
+				candidates.append((src.get_last_used(), count, src))
+		candidates.sort()
+		sourcepickler = SourcePickler()
+		spilled = 0
+		for last_used, count, src in candidates:
+			if in_memory <= max_leaves:
+				break
+			if sourcepickler.spill_source(src):
+				self.output_debug("Moved %d leaves of %s to disk" % (count, src))
+				in_memory -= count
+				spilled += 1
+		return spilled
+
+	def get_memory_sizes(self):
+		"Return a dict of source -> estimated memory used by its leaves"
+		return dict((src, catalogsnapshot.memory_size(src.cached_items))
+		            for src in self.sources)
+
 	def save_data(self):
 		"Save (important) user data/configuration"
 		if not self.loaded_successfully:
@@ -533,11 +962,9 @@ class SourceController (pretty.OutputMixin):
 	def _pickle_sources(self, sources):
 		sourcepickler = SourcePickler()
 		sourcepickler.rm_old_cachefiles()
-		for source in sources:
-			if (source.is_dynamic() or
-				SourceDataPickler.source_has_config(source)):
-				continue
-			self._pickle_source(source, pickler=sourcepickler)
+		sourcepickler.pickle_sources([source for source in sources
+			if not (source.is_dynamic() or
+			        SourceDataPickler.source_has_config(source))])
 
 	@classmethod
 	def _pickle_source(self, source, pickler=None):
@@ -548,44 +975,147 @@ class SourceController (pretty.OutputMixin):
 		"""
 		Try to restore the source that is equivalent to the
 		"dummy" instance @source, from cache, or from saved configuration.
-		yield the instances that succeed.
+		Return the instances that succeed.
+
+		The files are read in the worker threads of .restore_loader,
+		the configuration is applied in this thread.
 		"""
 		sourcepickler = SourcePickler()
 		configsaver = SourceDataPickler()
-		for source in set(sources):
+		config_files = {}
+		for source in sources:
 			if configsaver.source_has_config(source):
-				configsaver.load_source(source)
-			else:
-				source = sourcepickler.unpickle_source(source)
-			if source:
-				yield source
+				config_files[source] = configsaver.get_filename(source)
+		if sourcepickler.should_use_cache():
+			# open the snapshot before the workers share it
+			sourcepickler._get_snapshot()
+
+		def restore(source):
+			if source in config_files:
+				return configsaver._load_data(config_files[source])
+			return sourcepickler.unpickle_source(source)
+
+		restored = []
+		for source, result, exc_info, duration in \
+				self.restore_loader.map(set(sources), restore, "restore"):
+			self._record_timing(source, "restore", duration)
+			with pluginload.exception_guard(source):
+				if exc_info is not None:
+					raise exc_info[0], exc_info[1], exc_info[2]
+				if source in config_files:
+					configsaver.restore_source(source, result)
+					result = source
+				if result:
+					restored.append(result)
+		return restored
+
+	def _restore_added(self):
+		"Replace the sources added so far by their restored instances"
+		unrestored, self._unrestored = self._unrestored, set()
+		for source in self._try_restore(unrestored):
+			self._replace(source)
 
 	def _remove_source(self, source):
 		"Oust @source from catalog if any exception is raised"
+		self._invalidate_root()
 		self.sources.discard(source)
 		self.toplevel_sources.discard(source)
+		self._leaf_index.pop(id(source), None)
 		source_type = type(source)
 		for typ in self.content_decorators:
 			self.content_decorators[typ].discard(source_type)
 
 	def initialize(self):
-		"Initialize all sources and cache toplevel sources"
-		self._initialize_sources(self.sources)
+		"Restore and initialize all sources and cache toplevel sources"
+		self._load_start = time.time()
+		with tracing.span("restore", "catalog"):
+			self._restore_added()
+		with tracing.span("initialize", "catalog"):
+			self._initialize_sources(self.sources)
 		self.rescanner.set_catalog(self.sources)
-		self._cache_sources(self.toplevel_sources)
+		with tracing.span("cache", "catalog"):
+			self._cache_sources(self.toplevel_sources)
 		self.loaded_successfully = True
+		self._report_timings()
 
 	def _initialize_sources(self, sources):
+		# Initialize in the main thread, since sources connect to
+		# signals and set up file monitors here
 		for src in set(sources):
+			start = time.time()
 			with pluginload.exception_guard(src, self._remove_source, src):
 				src.initialize()
+			duration = time.time() - start
+			tracing.add_span(unicode(src), "source initialize", start, duration)
+			self._record_timing(src, "initialize", duration)
 
 	def _cache_sources(self, sources):
-		# Make sure that the toplevel sources are chached
-		# either newly rescanned or the cache is fully loaded
+		"""
+		Make sure that @sources are cached: either newly rescanned or the
+		cache is fully loaded
+
+		Sources that need a rescan are rescanned in the loader's worker
+		threads, and each is published to the catalog when it is done;
+		until then, it is empty.
+		"""
 		for src in set(sources):
-			with pluginload.exception_guard(src, self._remove_source, src):
-				self.rescanner.rescan_now(src, force_update=False)
+			if src in self._loading or catalogindex.is_complete(src.cached_items):
+				continue
+			if src.is_dynamic():
+				# dynamic sources may use the GUI, check them here
+				with pluginload.exception_guard(src, self._remove_source, src):
+					self.rescanner.rescan_now(src, force_update=False)
+				continue
+			src.set_cached_items([])
+			self._load_leaves(src)
+
+	def _load_leaves(self, src):
+		self._loading.add(src)
+		src.set_loading(True)
+		self.loader.submit(src, base.Source.load_leaves, self._source_loaded,
+				"cache")
+
+	def reload_source(self, src):
+		"""Load the leaves of @src again in a worker thread; its cached
+		leaves are replaced when they are loaded"""
+		if src not in self.sources:
+			src.mark_for_update()
+		elif src not in self._loading:
+			self._load_leaves(src)
+
+	def _source_loaded(self, src, leaves, exc_info, duration):
+		self._loading.discard(src)
+		src.set_loading(False)
+		self._record_timing(src, "cache", duration)
+		if src not in self.sources:
+			return
+		with pluginload.exception_guard(src, self._remove_source, src):
+			if exc_info is not None:
+				# the source is left empty for catalogs that still use it
+				raise exc_info[0], exc_info[1], exc_info[2]
+			src.set_cached_items(leaves)
+			src.output_debug("Loaded %d items" % len(leaves))
+		if not self._loading:
+			self._report_timings()
+
+	def _record_timing(self, src, step, duration):
+		self.load_timings.setdefault(src, {})[step] = duration
+		self.output_debug("%s %s in %.3f s" % (step.capitalize(), src, duration))
+
+	def _report_timings(self):
+		"Report the slowest sources, once all sources are loaded"
+		if self._loading or self._load_start is None:
+			return
+		self.output_info("Loaded %d sources in %.3f s" %
+				(len(self.sources), time.time() - self._load_start))
+		self._load_start = None
+		tracing.mark("sources loaded")
+		tracing.write_trace_file()
+		slowest = sorted(self.load_timings.items(), reverse=True,
+				key=lambda item: sum(item[1].values()))
+		for src, steps in slowest[:5]:
+			details = ", ".join("%s %.3f s" % step for step in sorted(steps.items()))
+			self.output_debug("Slow source %s: %s" % (src, details))
 
 
 _source_controller = None
@@ -595,3 +1125,6 @@ def GetSourceController():
 		_source_controller = SourceController()
 	return _source_controller
 
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
@@ -1,3 +1,4 @@
+import heapq
 import itertools
 
 try:
@@ -99,6 +100,44 @@ def UniqueIterator(seq, key=None):
 				yield obj
 				coll.add(K)
 
+def top_sorted(seq, k, key=None, reverse=False):
+	"""
+	yield items of @seq in the order of sorted(seq, key=key, reverse=reverse)
+
+	The first @k items are selected without sorting all of @seq; the
+	rest is only sorted if the iteration continues past them.
+
+	>>> list(top_sorted([3, 1, 4, 1, 5, 9, 2, 6], 3))
+	[1, 1, 2, 3, 4, 5, 6, 9]
+	>>> it = top_sorted(["bb", "c", "aa", "d"], 2, key=len, reverse=True)
+	>>> list(itertools.islice(it, 3))
+	['bb', 'aa', 'c']
+	"""
+	items = list(seq)
+	if len(items) > k:
+		select = heapq.nlargest if reverse else heapq.nsmallest
+		for item in select(k, items, key=key):
+			yield item
+	else:
+		k = 0
+	items.sort(key=key, reverse=reverse)
+	for item in itertools.islice(items, k, None):
+		yield item
+
+def cancellable(seq, cancelled, interval=500):
+	"""
+	yield items of @seq until @cancelled() returns True,
+	which is checked every @interval items
+
+	>>> list(cancellable(xrange(10), lambda: False))
+	[0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+	>>> list(cancellable(xrange(10), lambda: True))
+	[]
+	"""
+	for idx, item in enumerate(seq):
+		if not idx % interval and cancelled():
+			return
+		yield item
 
 if not OrderedDict:
 	"""
@@ -0,0 +1,147 @@
+"""
+A cache of scaled icons on disk, so that icons don't have to be loaded
+and scaled again on each start.
+
+Each icon is stored in its own file, named by a digest of its key: a
+short header followed by the pixel data, which can be read (or memory
+mapped) straight into a pixbuf. The cache is bounded by MAX_SIZE; the
+least recently used icons are removed first.
+
+Keys for files include their modification time, so that changed files
+are loaded again.
+"""
+
+from __future__ import with_statement
+
+import hashlib
+import os
+import struct
+import threading
+
+import gtk
+
+from kupfer import config
+from kupfer import pretty
+
+VERSION = 1
+# Total size of the cache in bytes
+MAX_SIZE = 16 * 1024 * 1024
+# After exceeding MAX_SIZE, remove icons down to this size
+TRIM_SIZE = 12 * 1024 * 1024
+
+# magic, version, width, height, rowstride, has alpha
+_HEADER = struct.Struct("<4sIIIII")
+_MAGIC = "KPIX"
+
+_lock = threading.Lock()
+# Total size of the icons in the cache, counted on first store
+_total_size = None
+
+def _get_cache_dir():
+	cache_home = config.get_cache_home()
+	if not cache_home:
+		return None
+	cache_dir = os.path.join(cache_home, "icons-%d" % VERSION)
+	if not os.path.isdir(cache_dir):
+		try:
+			os.makedirs(cache_dir, 0700)
+		except OSError, exc:
+			pretty.print_debug(__name__, exc)
+			return None
+	return cache_dir
+
+def _get_path(key):
+	cache_dir = _get_cache_dir()
+	return cache_dir and os.path.join(cache_dir, hashlib.md5(key).hexdigest())
+
+def file_key(filename, width, height):
+	"""Return the cache key for the file @filename scaled to @width x @height,
+	or None if the file does not exist
+	"""
+	try:
+		mtime = os.stat(filename).st_mtime
+	except OSError:
+		return None
+	return "file:%s:%r:%dx%d" % (filename, mtime, width, height)
+
+def load(key):
+	"""Return the pixbuf cached under @key, or None"""
+	filepath = key and _get_path(key)
+	if not filepath:
+		return None
+	try:
+		with open(filepath, "rb") as cfile:
+			data = cfile.read()
+		# mark as recently used
+		os.utime(filepath, None)
+	except (IOError, OSError):
+		return None
+	try:
+		magic, version, width, height, rowstride, has_alpha = \
+				_HEADER.unpack_from(data)
+		if magic != _MAGIC or version != VERSION:
+			return None
+		return gtk.gdk.pixbuf_new_from_data(data[_HEADER.size:],
+				gtk.gdk.COLORSPACE_RGB, bool(has_alpha), 8, width, height,
+				rowstride)
+	except (struct.error, ValueError, TypeError), exc:
+		pretty.print_debug(__name__, "Invalid cached icon", filepath, exc)
+		return None
+
+def store(key, pixbuf):
+	"""Cache @pixbuf under @key"""
+	filepath = key and _get_path(key)
+	if not filepath or pixbuf is None:
+		return
+	if (pixbuf.get_colorspace() != gtk.gdk.COLORSPACE_RGB or
+	    pixbuf.get_bits_per_sample() != 8):
+		return
+	header = _HEADER.pack(_MAGIC, VERSION, pixbuf.get_width(),
+			pixbuf.get_height(), pixbuf.get_rowstride(),
+			int(pixbuf.get_has_alpha()))
+	data = header + pixbuf.get_pixels()
+	tmppath = "%s.%d.tmp" % (filepath, threading.current_thread().ident)
+	try:
+		with open(tmppath, "wb") as cfile:
+			cfile.write(data)
+		os.rename(tmppath, filepath)
+	except (IOError, OSError), exc:
+		pretty.print_debug(__name__, "Could not cache icon", exc)
+		return
+	global _total_size
+	with _lock:
+		if _total_size is None:
+			_total_size = _get_sizes_by_age(os.path.dirname(filepath))[1]
+		else:
+			_total_size += len(data)
+		if _total_size > MAX_SIZE:
+			_total_size = _trim(os.path.dirname(filepath))
+
+def _get_sizes_by_age(cache_dir):
+	"""Return a list of (mtime, size, path) of the cached icons, oldest
+	first, and their total size
+	"""
+	entries = []
+	for name in os.listdir(cache_dir):
+		filepath = os.path.join(cache_dir, name)
+		try:
+			stat = os.stat(filepath)
+		except OSError:
+			continue
+		entries.append((stat.st_mtime, stat.st_size, filepath))
+	entries.sort()
+	return entries, sum(size for mtime, size, filepath in entries)
+
+def _trim(cache_dir):
+	"""Remove the least recently used icons, and return the new total size"""
+	entries, total_size = _get_sizes_by_age(cache_dir)
+	for mtime, size, filepath in entries:
+		if total_size <= TRIM_SIZE:
+			break
+		try:
+			os.unlink(filepath)
+		except OSError:
+			continue
+		total_size -= size
+	pretty.print_debug(__name__, "Trimmed icon cache to", total_size)
+	return total_size
@@ -9,6 +9,7 @@ from gobject import GError
 
 from kupfer import config
 from kupfer import datatools
+from kupfer import iconcache
 from kupfer import pretty
 from kupfer import scheduler
 
@@ -172,10 +173,42 @@ def ComposedIconSmall(baseicon, emblem, **kwargs):
 	return ci
 
 
+def _icon_key(icon):
+	"""Return a string identifying @icon (name or GIcon), or None"""
+	if isinstance(icon, basestring):
+		return icon
+	if isinstance(icon, ThemedIcon):
+		return ",".join(icon.get_names())
+	if isinstance(icon, FileIcon):
+		path = icon.get_file().get_path()
+		return path and iconcache.file_key(path, 0, 0)
+	return None
+
+def _composed_icon_key(composed_icon, icon_size):
+	"""Return the icon cache key for @composed_icon, or None"""
+	if _IconRenderer is not IconRenderer:
+		return None
+	settings = gtk.settings_get_default()
+	theme_name = settings and settings.get_property("gtk-icon-theme-name")
+	base_key = _icon_key(composed_icon.baseicon)
+	emblem_key = _icon_key(composed_icon.emblemicon)
+	if not (theme_name and base_key and emblem_key):
+		return None
+	return "composed:%s:%s:%s:%d" % (theme_name, base_key, emblem_key,
+	                                 icon_size)
+
 def _render_composed_icon(composed_icon, icon_size):
 	# If it's too small, render as fallback icon
 	if icon_size < composed_icon.minimum_icon_size:
 		return _get_icon_for_standard_gicon(composed_icon, icon_size)
+	key = _composed_icon_key(composed_icon, icon_size)
+	if key:
+		for icon in get_icon(key, icon_size):
+			return icon
+		icon = iconcache.load(key)
+		if icon is not None:
+			store_icon(key, icon_size, icon)
+			return icon
 	emblemicon = composed_icon.emblemicon
 	baseicon = composed_icon.baseicon
 	toppbuf = _get_icon_dwim(emblemicon, icon_size)
@@ -191,6 +224,9 @@ def _render_composed_icon(composed_icon, icon_size):
 	# http://library.gnome.org/devel/gdk-pixbuf/unstable//gdk-pixbuf-scaling.html
 	toppbuf.composite(dest, dcoord, dcoord, dsize, dsize,
 			dcoord, dcoord, fr, fr, gtk.gdk.INTERP_BILINEAR, 255)
+	if key:
+		store_icon(key, icon_size, dest)
+		iconcache.store(key, dest)
 	return dest
 
 def get_thumbnail_for_file(uri, width=-1, height=-1):
@@ -215,19 +251,25 @@ def get_pixbuf_from_file(thumb_path, width=-1, height=-1):
 	Return a Pixbuf thumbnail for the file at @thumb_path
 	sized @width x @height
 	For non-icon pixbufs:
-	We might cache these, but on different terms than the icon cache
+	These are cached on disk, but not in the icon cache
 	if @thumb_path is None, return None
 	"""
 	if not thumb_path:
 		return None
+	key = iconcache.file_key(thumb_path, width, height)
+	icon = iconcache.load(key)
+	if icon is not None:
+		return icon
 	try:
 		icon = pixbuf_new_from_file_at_size(thumb_path, width, height)
-		return icon
 	except GError, e:
 		# this error is not important, the program continues on fine,
 		# so we put it in debug output.
 		pretty.print_debug(__name__, "get_pixbuf_from_file file:", thumb_path,
 			"error:", e)
+		return None
+	iconcache.store(key, icon)
+	return icon
 
 def get_gicon_for_file(uri):
 	"""
@@ -310,21 +352,39 @@ class IconRenderer (object):
 				                              ICON_LOOKUP_FORCE_SIZE)
 			except GError:
 				pass
+		# Icons from theme files are cached on disk by file name,
+		# so they are looked up again after a theme change
 		try:
-			return _default_theme.load_icon(icon_name, icon_size,
-			                                ICON_LOOKUP_USE_BUILTIN |
-			                                ICON_LOOKUP_FORCE_SIZE)
+			info = _default_theme.lookup_icon(icon_name, icon_size,
+			                                  ICON_LOOKUP_USE_BUILTIN |
+			                                  ICON_LOOKUP_FORCE_SIZE)
+			if info is None:
+				return None
+			filename = info.get_filename()
+			key = filename and iconcache.file_key(filename, icon_size,
+			                                      icon_size)
+			icon = iconcache.load(key)
+			if icon is None:
+				icon = info.load_icon()
+				iconcache.store(key, icon)
+			return icon
 		except GError:
 			pass
 
 	@classmethod
 	def pixbuf_for_file(cls, file_path, icon_size):
+		key = iconcache.file_key(file_path, icon_size, icon_size)
+		icon = iconcache.load(key)
+		if icon is not None:
+			return icon
 		try:
 			icon = gtk.gdk.pixbuf_new_from_file_at_size(file_path, icon_size,
 			                                            icon_size)
-			return icon
 		except GError:
 			pretty.print_exc(__name__)
+			return None
+		iconcache.store(key, icon)
+		return icon
 
 _IconRenderer = IconRenderer
 
@@ -162,6 +162,8 @@ def gtkmain(quiet):
 	w.main(quiet=quiet)
 
 def main():
+	from kupfer import tracing
+	tracing.mark("start")
 	# parse commandline before importing UI
 	cli_opts = get_options()
 	print_banner()
@@ -9,6 +9,8 @@ __all__ = [
 	"KupferObject", "Leaf", "Action", "Source", "TextSource",
 ]
 
+import time
+
 # If no gettext function is loaded at this point, we load a substitute,
 # so that testing code can still work
 import __builtin__
@@ -41,6 +43,14 @@ class _BuiltinObject (type):
 		return type.__new__(mcls, name, bases, dict)
 
 
+def stable_repr_key(func):
+	"""Decorator for a repr_key method whose value only depends on the
+	name of the object and on state that does not change after it is
+	constructed, so that the repr can be cached
+	"""
+	func.kupfer_stable_repr_key = True
+	return func
+
 class KupferObject (object):
 	"""
 	Base class for kupfer data model
@@ -74,9 +84,10 @@ class KupferObject (object):
 
 	def kupfer_add_alias(self, alias):
 		if alias != unicode(self):
-			if not hasattr(self, "name_aliases"):
-				self.name_aliases = set()
-			self.name_aliases.add(alias)
+			# aliases are kept in a tuple, which is smaller than a set
+			aliases = getattr(self, "name_aliases", ())
+			if alias not in aliases:
+				self.name_aliases = tuple(aliases) + (alias, )
 
 	def __str__(self):
 		return toutf8(self.name)
@@ -86,12 +97,51 @@ class KupferObject (object):
 		return self.name
 
 	def __repr__(self):
+		"""
+		The repr is used as the object's identity (learning, hashing).
+		It is cached for objects whose repr_key is a stable_repr_key,
+		for as long as their class and name are the same
+
+		>>> leaf = Leaf(1, u"name")
+		>>> repr(leaf) is repr(leaf)
+		True
+		>>> leaf.name = u"other"
+		>>> repr(leaf)   # doctest: +ELLIPSIS
+		'<...Leaf other>'
+
+		An object with its own repr_key is not cached:
+
+		>>> class Counter (Leaf):
+		...     def repr_key(self):
+		...         return self.object[0]
+		>>> counter = Counter([1], u"counter")
+		>>> repr(counter)   # doctest: +ELLIPSIS
+		'<...Counter 1>'
+		>>> counter.object[0] = 2
+		>>> repr(counter)   # doctest: +ELLIPSIS
+		'<...Counter 2>'
+		"""
+		cacheable = _repr_is_cacheable(self.__class__)
+		if cacheable:
+			cached = self.__dict__.get("_kupfer_repr")
+			name = getattr(self, "name", None)
+			if cached:
+				cls, cached_name, repr_str = cached.object
+				if cls is self.__class__ and cached_name is name:
+					return repr_str
 		key = self.repr_key()
 		keys = " %s" % (key, ) if key else ""
 		if self._is_builtin:
-			return "<builtin.%s%s>" % (self.__class__.__name__, keys)
-		return "<%s.%s%s>" % (self.__module__, self.__class__.__name__, keys)
-
+			repr_str = "<builtin.%s%s>" % (self.__class__.__name__, keys)
+		else:
+			repr_str = "<%s.%s%s>" % (self.__module__, self.__class__.__name__,
+			                          keys)
+		if cacheable:
+			self.__dict__["_kupfer_repr"] = \
+					_NonpersistentToken((self.__class__, name, repr_str))
+		return repr_str
+
+	@stable_repr_key
 	def repr_key(self):
 		"""
 		Return an object whose str() will be used in the __repr__,
@@ -173,6 +223,19 @@ class _NonpersistentToken (object):
 	def __reduce__(self):
 		return (sum, ((), None))
 
+def _repr_is_cacheable(cls):
+	"""Return if the repr of instances of @cls only depends on their
+	class, name and construction, so that it can be cached
+	"""
+	try:
+		return cls.__dict__["_kupfer_repr_cacheable"]
+	except KeyError:
+		cacheable = (getattr(cls.repr_key.im_func,
+		                     "kupfer_stable_repr_key", False) and
+		             cls.__str__.im_func is KupferObject.__str__.im_func)
+		setattr(cls, "_kupfer_repr_cacheable", cacheable)
+		return cacheable
+
 class Leaf (KupferObject):
 	"""
 	Base class for objects
@@ -233,6 +296,7 @@ class Action (KupferObject):
 		return (type(self) == type(other) and repr(self) == repr(other) and
 				unicode(self) == unicode(other))
 
+	@stable_repr_key
 	def repr_key(self):
 		"""by default, actions of one type are all the same"""
 		return ""
@@ -334,12 +398,73 @@ class Source (KupferObject, pretty.OutputMixin):
 		return self._version
 
 	def __eq__(self, other):
+		"""
+		Sources are compared by their repr, which is cached:
+
+		>>> class Counted (Source):
+		...     calls = 0
+		...     @stable_repr_key
+		...     def repr_key(self):
+		...         Counted.calls += 1
+		...         return u"key"
+		>>> src = Counted(u"Counted")
+		>>> src == Counted(u"Counted") and hash(src) == hash(src)
+		True
+		>>> src == src and hash(src) == hash(repr(src))
+		True
+		>>> Counted.calls
+		2
+		"""
 		return (type(self) == type(other) and repr(self) == repr(other) and
 		        self.version == other.version)
 
 	def __hash__(self ):
 		return hash(repr(self))
 
+	def set_cached_items(self, items):
+		"""Set .cached_items to @items, and count a new generation of
+		the cached leaves
+
+		>>> src = Source(u"Source")
+		>>> src.get_generation()
+		0
+		>>> src.set_cached_items([Leaf(1, u"a")])
+		>>> src.get_generation()
+		1
+		"""
+		self.cached_items = items
+		generation = _NonpersistentToken(self.get_generation() + 1)
+		self.__dict__["_items_generation"] = generation
+
+	def get_generation(self):
+		"""Return a number that changes whenever the cached items are
+		set with .set_cached_items
+
+		A source restored from cache starts at 0.
+		"""
+		generation = self.__dict__.get("_items_generation")
+		return (generation.object if generation is not None else 0) or 0
+
+	def get_last_used(self):
+		"""Return the time the leaves were last asked for in this
+		session, or 0"""
+		last_used = self.__dict__.get("_last_used")
+		return (last_used.object if last_used is not None else 0) or 0
+
+	def set_loading(self, loading):
+		"""Mark that the leaves are being loaded in a worker thread,
+		if @loading, or that one such load is done"""
+		count = self.__dict__.get("_loading")
+		count = (count.object if count is not None else 0) or 0
+		count = max(count + (1 if loading else -1), 0)
+		self.__dict__["_loading"] = _NonpersistentToken(count)
+
+	def is_loading(self):
+		"""Return True while the leaves are being loaded in a worker
+		thread; the cached leaves will then be replaced"""
+		count = self.__dict__.get("_loading")
+		return bool(count is not None and count.object)
+
 	def toplevel_source(self):
 		return self
 
@@ -359,6 +484,7 @@ class Source (KupferObject, pretty.OutputMixin):
 		"""
 		pass
 
+	@stable_repr_key
 	def repr_key(self):
 		return ""
 
@@ -390,7 +516,44 @@ class Source (KupferObject, pretty.OutputMixin):
 
 		it should be reloaded on next used (if normally cached)
 		"""
-		self.cached_items = None
+		self.set_cached_items(None)
+
+	def update_leaves(self, added=(), removed=()):
+		"""
+		Update the cached leaves incrementally: add the leaves @added
+		and remove the leaves with the same repr as one in @removed
+
+		Return False if the cache is only partly loaded and can't be
+		updated; the source should then be marked for update.
+
+		>>> src = Source(u"Source")
+		>>> src.cached_items = [Leaf(1, u"a"), Leaf(2, u"b")]
+		>>> src.update_leaves(added=[Leaf(3, u"c")], removed=[Leaf(2, u"b")])
+		True
+		>>> [unicode(leaf) for leaf in src.cached_items]
+		[u'a', u'c']
+		>>> src.cached_items = datatools.SavedIterable(iter([Leaf(1, u"a")]))
+		>>> src.update_leaves(added=[Leaf(3, u"c")])
+		False
+		"""
+		items = self.cached_items
+		if items is None or self.is_dynamic():
+			return True
+		if isinstance(items, datatools.SavedIterable):
+			if items.iterator is not None:
+				return False
+			items = items.data
+		added = aslist(added)
+		drop = set(repr(leaf) for leaf in added)
+		drop.update(repr(leaf) for leaf in removed)
+		leaves = [leaf for leaf in items if repr(leaf) not in drop]
+		leaves.extend(added)
+		if self.should_sort_lexically():
+			leaves = locale_sort(leaves)
+		self.set_cached_items(leaves)
+		self.output_debug("Updated items, %d added, %d removed" %
+				(len(added), len(items) + len(added) - len(leaves)))
+		return True
 
 	def should_sort_lexically(self):
 		"""
@@ -420,16 +583,34 @@ class Source (KupferObject, pretty.OutputMixin):
 			else:
 				return sort_func(self.get_items())
 
+		if not force_update:
+			self.__dict__["_last_used"] = _NonpersistentToken(time.time())
 		if self.cached_items is None or force_update:
 			if force_update:
-				self.cached_items = aslist(sort_func(self.get_items_forced()))
+				self.set_cached_items(self.load_leaves(force_update=True))
 				self.output_debug("Loaded %d items" % len(self.cached_items))
 			else:
-				self.cached_items = \
-						datatools.SavedIterable(sort_func(self.get_items()))
+				self.set_cached_items(
+						datatools.SavedIterable(sort_func(self.get_items())))
 				self.output_debug("Loaded items")
 		return self.cached_items
 
+	def load_leaves(self, force_update=False):
+		"""
+		Return a list of all leaves, computed now
+
+		The cache is neither used nor updated, so this can be called in a
+		thread while the cache is in use.
+		if @force_update, use get_items_forced
+		"""
+		if self.should_sort_lexically():
+			sort_func = locale_sort
+		else:
+			sort_func = lambda x: x
+		if force_update:
+			return aslist(sort_func(self.get_items_forced()))
+		return aslist(sort_func(self.get_items()))
+
 	def has_parent(self):
 		return False
 
@@ -500,3 +681,7 @@ class ActionGenerator (object):
 	def get_actions_for_leaf(self, leaf):
 		'''Return actions appropriate for given leaf. '''
 		return []
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
@@ -5,7 +5,12 @@ This module is a part of the program Kupfer, see the main program file for
 more information.
 """
 
+import os
+import time
+import weakref
+
 import gio
+import gobject
 
 class PicklingHelperMixin (object):
 	""" This pickling helper will define __getstate__/__setstate__
@@ -48,10 +53,16 @@ class NonpersistentToken (PicklingHelperMixin):
 class FilesystemWatchMixin (object):
 	"""A mixin for Sources watching directories"""
 
+	# Update with a full rescan instead, if more files change at once
+	max_incremental_changes = 500
+	# While the leaves are being loaded, apply changes after this delay
+	loading_retry_ms = 500
+
 	def monitor_directories(self, *directories, **kwargs):
 		"""Register @directories for monitoring;
 
-		On changes, the Source will be marked for update.
+		On changes, the Source will be updated incrementally if it
+		implements monitor_leaf_for_file, else marked for update.
 		This method returns a monitor token that has to be
 		stored for the monitor to be active.
 
@@ -66,7 +77,7 @@ class FilesystemWatchMixin (object):
 			gfile = gio.File(directory)
 			if not force and not gfile.query_exists():
 				continue
-			monitor = gfile.monitor_directory(gio.FILE_MONITOR_NONE, None)
+			monitor = gfile.monitor_directory(gio.FILE_MONITOR_SEND_MOVED, None)
 			if monitor:
 				monitor.connect("changed", self.__directory_changed)
 				tokens.append(monitor)
@@ -78,11 +89,123 @@ class FilesystemWatchMixin (object):
 		"""
 		return not (gfile and gfile.get_basename().startswith("."))
 
+	def monitor_leaf_for_file(self, gfile):
+		"""Return the leaf for @gfile, to add or remove it when @gfile is
+		created or deleted, or None to update the whole Source (default)
+		"""
+		return None
+
 	def __directory_changed(self, monitor, file1, file2, evt_type):
-		if (evt_type in (gio.FILE_MONITOR_EVENT_CREATED,
-				gio.FILE_MONITOR_EVENT_DELETED) and
-				self.monitor_include_file(file1)):
+		for gfile in (file1, file2):
+			if gfile is not None:
+				forget_file_access(gfile.get_path())
+		if evt_type == gio.FILE_MONITOR_EVENT_CREATED:
+			changes = [(file1, True)]
+		elif evt_type == gio.FILE_MONITOR_EVENT_DELETED:
+			changes = [(file1, False)]
+		elif evt_type == gio.FILE_MONITOR_EVENT_MOVED:
+			changes = [(file1, False), (file2, True)]
+		else:
+			return
+		changes = [(gfile, created) for gfile, created in changes
+		           if self.monitor_include_file(gfile)]
+		if not changes:
+			return
+		# Changes come in bursts, apply them together when idle
+		if self not in _pending_changes:
+			_pending_changes[self] = []
+			gobject.idle_add(self.__apply_changes)
+		_pending_changes[self].extend(changes)
+
+	def __apply_changes(self):
+		if self.is_loading():
+			# the loaded leaves will replace ours, and may not include
+			# the changes; apply them when the leaves are in place
+			gobject.timeout_add(self.loading_retry_ms, self.__apply_changes)
+			return False
+		changes = _pending_changes.pop(self, ())
+		if len(changes) > self.max_incremental_changes:
 			self.mark_for_update()
+			return False
+		# the last change of each file counts
+		latest = {}
+		for gfile, created in changes:
+			leaf = self.monitor_leaf_for_file(gfile)
+			if leaf is None:
+				self.mark_for_update()
+				return False
+			latest[repr(leaf)] = (leaf, created)
+		added = [leaf for leaf, created in latest.itervalues() if created]
+		removed = [leaf for leaf, created in latest.itervalues() if not created]
+		if not self.update_leaves(added, removed):
+			self.mark_for_update()
+		return False
+
+# Source -> list of (gfile, created) not yet applied
+_pending_changes = weakref.WeakKeyDictionary()
+
+# Seconds that a checked file access is trusted, unless the
+# file is reported changed by a directory monitor before that
+FILE_ACCESS_TTL = 2.0
+FILE_ACCESS_MAX = 10000
+
+# path -> (result, time of check), for each kind of check
+_file_access = {}
+_file_ids = {}
+
+def _cached_check(cache, filepath, check):
+	now = time.time()
+	cached = cache.get(filepath)
+	if cached is not None and now - cached[1] < FILE_ACCESS_TTL:
+		return cached[0]
+	if len(cache) >= FILE_ACCESS_MAX:
+		cache.clear()
+	result = check(filepath)
+	cache[filepath] = (result, now)
+	return result
+
+def _check_readable(filepath):
+	return os.access(filepath, os.R_OK)
+
+def _check_file_id(filepath):
+	try:
+		stat = os.stat(filepath)
+	except OSError:
+		return None
+	return (stat.st_dev, stat.st_ino)
+
+def is_readable(filepath):
+	"""Return if @filepath is readable, as os.access(@filepath, os.R_OK)
+
+	The result is cached for FILE_ACCESS_TTL seconds, so that the results
+	of one search (and the next few keystrokes) are checked only once.
+	"""
+	return _cached_check(_file_access, filepath, _check_readable)
+
+def get_file_id(filepath):
+	"""Return the (device, inode) of @filepath, or None if it can't be
+	accessed; cached as is_readable
+
+	>>> import tempfile
+	>>> fd, name = tempfile.mkstemp()
+	>>> os.close(fd)
+	>>> other = os.path.join(os.path.dirname(name), os.curdir,
+	...                      os.path.basename(name))
+	>>> get_file_id(name) == get_file_id(other)
+	True
+	>>> os.unlink(name)
+	>>> get_file_id(name) is None
+	False
+	>>> forget_file_access(name)
+	>>> get_file_id(name) is None
+	True
+	"""
+	return _cached_check(_file_ids, filepath, _check_file_id)
+
+def forget_file_access(filepath):
+	"""Drop the cached checks of @filepath"""
+	_file_access.pop(filepath, None)
+	_file_ids.pop(filepath, None)
 
 def reverse_action(action, rank=0):
 	"""Return a reversed version a three-part action
@@ -122,3 +245,6 @@ def reverse_action(action, rank=0):
 	ReverseAction.__name__ = "Reverse" + action.__name__
 	return ReverseAction
 
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
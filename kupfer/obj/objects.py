@@ -16,9 +16,10 @@ import gobject
 
 from kupfer import icons, launch, utils
 from kupfer import pretty
-from kupfer.obj.base import Leaf, Action
+from kupfer.obj.base import Leaf, Action, stable_repr_key
 from kupfer.obj.base import InvalidDataError, OperationError
 from kupfer.obj import fileactions
+from kupfer.obj.helplib import is_readable, get_file_id
 from kupfer.interface import TextRepresentation
 from kupfer.kupferstring import tounicode
 
@@ -70,14 +71,31 @@ class FileLeaf (Leaf, TextRepresentation):
 			self.kupfer_add_alias(alias)
 
 	def __eq__(self, other):
-		try:
-			return (type(self) == type(other) and
-					unicode(self) == unicode(other) and
-					path.samefile(self.object, other.object))
-		except OSError, exc:
-			pretty.print_debug(__name__, exc)
+		"""FileLeaves are equal if they have the same name and refer to the
+		same existing file; the file ids are cached as by is_readable
+
+		>>> import tempfile
+		>>> fd, name = tempfile.mkstemp()
+		>>> os.close(fd)
+		>>> link = name + ".link"
+		>>> os.symlink(name, link)
+		>>> FileLeaf(name, u"file") == FileLeaf(link, u"file")
+		True
+		>>> FileLeaf(name, u"file") == FileLeaf(link, u"link")
+		False
+		>>> os.unlink(link)
+		>>> os.unlink(name)
+		>>> from kupfer.obj.helplib import forget_file_access
+		>>> forget_file_access(name)
+		>>> FileLeaf(name) == FileLeaf(name)
+		False
+		"""
+		if not (type(self) == type(other) and unicode(self) == unicode(other)):
 			return False
+		file_id = get_file_id(self.object)
+		return file_id is not None and file_id == get_file_id(other.object)
 
+	@stable_repr_key
 	def repr_key(self):
 		return self.object
 
@@ -86,7 +104,7 @@ class FileLeaf (Leaf, TextRepresentation):
 		return path.realpath(self.object)
 
 	def is_valid(self):
-		return os.access(self.object, os.R_OK)
+		return is_readable(self.object)
 
 	def _is_executable(self):
 		return os.access(self.object, os.R_OK | os.X_OK)
@@ -454,3 +472,7 @@ class TextLeaf (Leaf, TextRepresentation):
 	def get_icon_name(self):
 		return "edit-select-all"
 
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
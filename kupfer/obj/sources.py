@@ -31,18 +31,34 @@ class FileSource (Source):
 			self.__class__.__name__,
 			', '.join('"%s"' % d for d in sorted(self.dirlist)), self.depth)
 
-	def get_items(self):
-		iters = []
-		
-		def mkleaves(directory):
-			files = utils.get_dirlist(directory, depth=self.depth,
-					exclude=self._exclude_file)
-			return (ConstructFileLeaf(f) for f in files)
+	def __getstate__(self):
+		"""The directory listings are not pickled; the first rescan
+		after loading lists all directories again
+
+		>>> import cPickle as pickle
+		>>> src = FileSource(["/tmp"])
+		>>> src._listings = {"/tmp": (0, [])}
+		>>> "_listings" in pickle.loads(pickle.dumps(src)).__dict__
+		False
+		>>> src._listings
+		{'/tmp': (0, [])}
+		"""
+		state = dict(self.__dict__)
+		state.pop("_listings", None)
+		return state
 
+	def get_items(self):
+		# Directory listings are kept with the source, so that
+		# a rescan only lists the directories that changed
+		old_listings = getattr(self, "_listings", None)
+		listings = {}
 		for d in self.dirlist:
-			iters.append(mkleaves(d))
-
-		return itertools.chain(*iters)
+			files = utils.iter_dirlist(d, depth=self.depth,
+					exclude=self._exclude_file, listings=listings,
+					old_listings=old_listings)
+			for f in files:
+				yield ConstructFileLeaf(f)
+		self._listings = listings
 
 	def should_sort_lexically(self):
 		return True
@@ -82,6 +98,13 @@ class DirectorySource (Source, PicklingHelperMixin, FilesystemWatchMixin):
 	def monitor_include_file(self, gfile):
 		return self.show_hidden or not gfile.get_basename().startswith('.')
 
+	def monitor_leaf_for_file(self, gfile):
+		# Desktop files may be AppLeaves, which are not identified by path
+		fname = gfile.get_basename()
+		if fname.endswith(".desktop"):
+			return None
+		return FileLeaf(path.join(self.directory, fname))
+
 	def get_items(self):
 		try:
 			for fname in os.listdir(self.directory):
@@ -166,13 +189,19 @@ class MultiSource (Source):
 
 	def get_items(self):
 		iterators = []
-		ui = datatools.UniqueIterator(S.toplevel_source() for S in self.sources)
-		for S in ui:
+		for S in self.get_toplevel_sources():
 			it = S.get_leaves()
 			iterators.append(it)
 
 		return itertools.chain(*iterators)
 
+	def get_toplevel_sources(self):
+		"""Return an iterator of the sources whose leaves we combine"""
+		return datatools.UniqueIterator(S.toplevel_source() for S in self.sources)
+
 	def get_description(self):
 		return _("Root catalog")
 
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
@@ -15,6 +15,7 @@ __kupfer_contents__ = (
 	)
 __kupfer_actions__ = (
 		"DebugInfo",
+		"StartupTimeline",
 		"Forget",
 	)
 __description__ = __doc__
@@ -30,6 +31,7 @@ class DebugInfo (Action):
 	def activate(self, leaf):
 		import StringIO
 		# NOTE: Core imports
+		from kupfer.core import catalogsnapshot
 		from kupfer.core import qfurl
 		from kupfer import uiutils
 		from kupfer import puid
@@ -79,7 +81,8 @@ class DebugInfo (Action):
 				"leaf" : src.get_leaf_repr(),
 				"provides" : list(src.provides()),
 				"cached_items": type(src.cached_items),
-				"len": isinstance(src.cached_items, list) and len(src.cached_items),
+				"len": hasattr(src.cached_items, "__len__") and len(src.cached_items),
+				"memory": catalogsnapshot.memory_size(src.cached_items),
 				} )
 			return base
 
@@ -107,6 +110,31 @@ class DebugInfo (Action):
 	def item_types(self):
 		yield Leaf
 
+class StartupTimeline (Action):
+	""" Show where the time of Kupfer's startup went """
+	rank_adjust = -50
+	def __init__(self):
+		Action.__init__(self, u"Startup Timeline")
+
+	def activate(self, leaf):
+		# NOTE: Core imports
+		from kupfer import tracing
+		from kupfer import uiutils
+
+		summary = tracing.get_summary()
+		filepath = tracing.write_trace_file()
+		if filepath:
+			summary += "\n\nTrace written to %s" % filepath
+		pretty.print_debug("debug", summary)
+		uiutils.show_text_result(summary)
+
+	def get_description(self):
+		return u"Show the startup timeline (for internal kupfer use)"
+	def get_icon_name(self):
+		return "emblem-system"
+	def item_types(self):
+		yield Leaf
+
 class Forget (Action):
 	rank_adjust = -10
 	def __init__(self):
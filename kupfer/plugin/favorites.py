@@ -35,19 +35,12 @@ class FavoritesSource (Source):
 	def config_restore(self, state):
 		self.references = state["favorites"]
 
-	def _lookup_item(self, id_):
-		itm = puid.resolve_unique_id(id_, excluding=self)
-		if itm is None:
-			return None
-		return itm
-
 	def _valid_item(self,  itm):
 		if hasattr(itm, "is_valid") and not itm.is_valid():
 			return False
 		return True
 
-	def _find_item(self, id_):
-		itm = self._lookup_item(id_)
+	def _store_item(self, id_, itm):
 		if itm is None or not self._valid_item(itm):
 			return None
 		if puid.is_reference(id_):
@@ -66,6 +59,13 @@ class FavoritesSource (Source):
 	def _update_items(self):
 		self.favorites = []
 		self.mark_for_update()
+		# resolve all the missing items at once
+		missing = [id_ for id_ in self.references
+		           if id_ not in self.persist_table and
+		              id_ not in self.reference_table]
+		resolved = puid.resolve_unique_ids(missing, excluding=self)
+		for id_, itm in zip(missing, resolved):
+			self._store_item(id_, itm)
 		for id_ in self.references:
 			if id_ in self.persist_table:
 				self.favorites.append(self.persist_table[id_])
@@ -73,11 +73,7 @@ class FavoritesSource (Source):
 			if id_ in self.reference_table:
 				self.favorites.append(self.reference_table[id_])
 				continue
-			itm = self._find_item(id_)
-			if itm is None:
-				self.output_debug("MISSING:", id_)
-			else:
-				self.favorites.append(itm)
+			self.output_debug("MISSING:", id_)
 
 	@classmethod
 	def add(cls, itm):
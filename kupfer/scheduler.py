@@ -1,7 +1,9 @@
+from __future__ import with_statement
 
 import gobject
 
 from kupfer import pretty
+from kupfer import tracing
 from kupfer.weaklib import gobject_connect_weakly
 
 _scheduler = None
@@ -19,18 +21,22 @@ class Scheduler (gobject.GObject, pretty.OutputMixin):
 		super(Scheduler, self).__init__()
 	def load(self):
 		self.output_debug("Loading")
-		self.emit("load")
-		self.emit("loaded")
+		self._emit_traced("load")
+		self._emit_traced("loaded")
 		self.output_debug("Loaded")
 	def display(self):
 		self.output_debug("Display")
-		self.emit("display")
+		self._emit_traced("display")
 		gobject.idle_add(self._after_display)
 	def _after_display(self):
 		self.output_debug("After Display")
-		self.emit("after-display")
+		self._emit_traced("after-display")
 	def finish(self):
-		self.emit("finish")
+		self._emit_traced("finish")
+		tracing.write_trace_file()
+	def _emit_traced(self, signal):
+		with tracing.span(signal, tracing.PHASE):
+			self.emit(signal)
 gobject.signal_new("load", Scheduler, gobject.SIGNAL_RUN_LAST,
 		gobject.TYPE_BOOLEAN, ())
 gobject.signal_new("loaded", Scheduler, gobject.SIGNAL_RUN_LAST,
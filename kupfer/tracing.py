@@ -0,0 +1,180 @@
+"""
+A timeline of Kupfer's startup: the scheduler phases, plugin loading and
+the steps of loading each source are recorded as spans with their start
+time and duration.
+
+The timeline can be written as a file in the Chrome trace event format
+(load it in chrome://tracing or Perfetto), which is done when the sources
+are loaded, and again at exit if more was recorded, when Kupfer is run
+with --debug.
+"""
+
+from __future__ import with_statement
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+from kupfer import pretty
+
+TRACE_FILE = "startup-trace.json"
+# The timeline only covers startup; stop recording after this many events
+MAX_EVENTS = 10000
+# The category of the scheduler phases and other marks
+PHASE = "phase"
+
+_start = time.time()
+_lock = threading.Lock()
+# (name, category, start, duration or None, thread name)
+_events = []
+# The number of events when the trace file was last written
+_written_count = None
+
+def _add_event(name, category, start, duration, thread=None):
+	thread = thread or threading.current_thread().name
+	with _lock:
+		if len(_events) < MAX_EVENTS:
+			_events.append((name, category, start, duration, thread))
+
+def add_span(name, category, start, duration, thread=None):
+	"""Record the span @name of @category that started at time @start
+	and lasted @duration seconds (measured elsewhere)
+
+	@thread is the name of the thread it ran in, the current by default.
+	"""
+	_add_event(name, category, start, duration, thread)
+
+def mark(name, category=PHASE):
+	"""Record the instant event @name"""
+	_add_event(name, category, time.time(), None)
+
+@contextlib.contextmanager
+def span(name, category):
+	"""Record the time spent in the with block as span @name"""
+	start = time.time()
+	try:
+		yield
+	finally:
+		_add_event(name, category, start, time.time() - start)
+
+def get_events():
+	"""Return a list of the recorded events, as tuples of
+	(name, category, start, duration, thread) ordered by start time
+
+	Times are in seconds since startup; duration is None for marks.
+	"""
+	with _lock:
+		events = list(_events)
+	events.sort(key=lambda e: e[2])
+	return [(n, c, s - _start, d, t) for n, c, s, d, t in events]
+
+def get_summary(count=10):
+	"""Return a text summary of the timeline: the phases, the total
+	time of each category and the @count slowest spans
+
+	>>> with span("load", PHASE):
+	...     mark("loaded")
+	>>> print get_summary()  # doctest: +ELLIPSIS
+	Phases (seconds since start):
+	     ...  load (... s)
+	     ...  loaded
+	<BLANKLINE>
+	Total time by category:
+	     ...  phase (1)
+	<BLANKLINE>
+	Slowest spans:
+	     ...  phase: load (at ..., MainThread)
+	"""
+	events = get_events()
+	lines = []
+	lines.append("Phases (seconds since start):")
+	for name, category, start, duration, thread in events:
+		if duration is None:
+			lines.append("  %8.3f  %s" % (start, name))
+		elif category == PHASE:
+			lines.append("  %8.3f  %s (%.3f s)" % (start, name, duration))
+	totals = {}
+	for name, category, start, duration, thread in events:
+		if duration is not None:
+			total, num = totals.get(category, (0.0, 0))
+			totals[category] = (total + duration, num + 1)
+	lines.append("")
+	lines.append("Total time by category:")
+	for category, (total, num) in sorted(totals.items(),
+			key=lambda item: item[1], reverse=True):
+		lines.append("  %8.3f  %s (%d)" % (total, category, num))
+	spans = [e for e in events if e[3] is not None]
+	spans.sort(key=lambda e: e[3], reverse=True)
+	lines.append("")
+	lines.append("Slowest spans:")
+	for name, category, start, duration, thread in spans[:count]:
+		lines.append("  %8.3f  %s: %s (at %.3f, %s)" %
+				(duration, category, name, start, thread))
+	return "\n".join(lines)
+
+def _to_trace_events(events):
+	pid = os.getpid()
+	thread_ids = {}
+	trace_events = []
+	for name, category, start, duration, thread in events:
+		tid = thread_ids.setdefault(thread, len(thread_ids) + 1)
+		event = {
+			"name": name,
+			"cat": category,
+			"ts": int(start * 1e6),
+			"pid": pid,
+			"tid": tid,
+		}
+		if duration is None:
+			event.update(ph="i", s="g")
+		else:
+			event.update(ph="X", dur=int(duration * 1e6))
+		trace_events.append(event)
+	for thread, tid in thread_ids.items():
+		trace_events.append({"name": "thread_name", "ph": "M", "pid": pid,
+			"tid": tid, "args": {"name": thread}})
+	return trace_events
+
+def write(filepath):
+	"""Write the timeline to @filepath in the Chrome trace event format"""
+	trace = {
+		"traceEvents": _to_trace_events(get_events()),
+		"displayTimeUnit": "ms",
+	}
+	tmppath = filepath + ".tmp"
+	with open(tmppath, "w") as tfile:
+		json.dump(trace, tfile)
+	os.rename(tmppath, filepath)
+
+def write_trace_file():
+	"""Write the timeline to the trace file in the cache directory, if
+	Kupfer is run with debug output. Return the path or None
+
+	The file is not written again if no events were recorded since.
+	"""
+	global _written_count
+	from kupfer import config
+	if not pretty.debug:
+		return None
+	cache_home = config.get_cache_home()
+	if not cache_home:
+		return None
+	filepath = os.path.join(cache_home, TRACE_FILE)
+	with _lock:
+		count = len(_events)
+	if count == _written_count:
+		return filepath
+	try:
+		write(filepath)
+	except (IOError, OSError), exc:
+		pretty.print_error(__name__, "Could not write trace:", exc)
+		return None
+	_written_count = count
+	pretty.print_info(__name__, "Wrote startup trace to", filepath)
+	return filepath
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
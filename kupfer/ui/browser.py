@@ -17,6 +17,7 @@ from kupfer import version
 
 from kupfer import scheduler
 from kupfer.ui import accelerators
+from kupfer.ui import iconloader
 from kupfer.ui import keybindings
 from kupfer.ui import listen
 from kupfer.ui import uievents
@@ -192,6 +193,7 @@ class LeafModel (object):
 
 	def clear(self):
 		"""Clear the model and reset its base"""
+		iconloader.GetIconLoader().cancel(self)
 		self.store.clear()
 		self.base = None
 
@@ -215,22 +217,25 @@ class LeafModel (object):
 		# first.object is a leaf
 		return first
 
-	def _get_row(self, rankable):
+	def _get_row(self, rankable, icon):
 		"""Use the UI description functions get_*
 		to initialize @rankable into the model
 		"""
 		leaf, rank = rankable.object, rankable.rank
-		icon = self.get_icon(leaf)
 		markup = self.get_label_markup(rankable)
 		info = self.get_aux_info(leaf)
 		rank_str = self.get_rank_str(rank)
 		return (rankable, icon, markup, info, rank_str)
 
 	def add(self, rankable):
-		self.store.append(self._get_row(rankable))
+		icon = self._get_row_icon(rankable.object)
+		treeiter = self.store.append(self._get_row(rankable, icon))
+		self._load_row_icon(rankable.object, treeiter)
 
 	def add_first(self, rankable):
-		self.store.prepend(self._get_row(rankable))
+		icon = self._get_row_icon(rankable.object)
+		treeiter = self.store.prepend(self._get_row(rankable, icon))
+		self._load_row_icon(rankable.object, treeiter)
 
 	def get_icon_size(self):
 		return gtk.icon_size_lookup(gtk.icon_size_from_name("kupfer-small"))[0]
@@ -240,6 +245,32 @@ class LeafModel (object):
 		if sz >= 8:
 			return leaf.get_thumbnail(sz, sz) or leaf.get_pixbuf(sz)
 
+	def _get_row_icon(self, leaf):
+		"""Return the icon to insert a row with: a placeholder if the
+		icon of @leaf will be loaded in the background
+		"""
+		sz = self.get_icon_size()
+		if sz >= 8 and iconloader.can_load_in_thread(leaf):
+			return icons.get_icon_for_name(leaf.fallback_icon_name, sz)
+		return self.get_icon(leaf)
+
+	def _load_row_icon(self, leaf, treeiter):
+		"""Load the icon of @leaf in the background, for the row @treeiter"""
+		sz = self.get_icon_size()
+		if not (sz >= 8 and iconloader.can_load_in_thread(leaf)):
+			return
+		path = self.store.get_path(treeiter)
+		rowref = gtk.TreeRowReference(self.store, path)
+		def job():
+			return iconloader.lookup_icon(leaf, sz)
+		def set_icon(lookup):
+			if not rowref.valid():
+				return
+			icon = iconloader.render_icon(leaf, sz, lookup)
+			rowiter = self.store.get_iter(rowref.get_path())
+			self.store.set_value(rowiter, self.icon_col, icon)
+		iconloader.GetIconLoader().submit(self, job, set_icon)
+
 	def get_label_markup(self, rankable):
 		leaf = rankable.object
 		# Here we use the items real name
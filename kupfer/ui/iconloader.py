@@ -0,0 +1,130 @@
+"""
+Load icons and thumbnails of leaves in a few worker threads,
+so that a result list is shown before its icons are ready.
+
+Only the icons of files are loaded this way: the threads look up
+their thumbnails and GIcons, which may need file access, and pixbufs
+are looked up in the icon theme in the main loop. Other leaves may
+share state with the main loop, and their icons are loaded there.
+Loads are submitted on a channel (for example a list model) and all
+outstanding loads of a channel are cancelled together.
+"""
+
+from __future__ import with_statement
+
+import collections
+import threading
+
+import gobject
+
+from kupfer import icons
+from kupfer import pretty
+from kupfer.obj.objects import FileLeaf
+
+# The methods that make the icon of a FileLeaf
+_FILE_ICON_METHODS = ("get_pixbuf", "get_thumbnail", "get_gicon",
+                      "get_icon_name")
+
+class IconLoader (pretty.OutputMixin):
+	def __init__(self, workers=2):
+		self._lock = threading.Lock()
+		self._jobs = collections.deque()
+		self._generation = collections.defaultdict(int)
+		self._workers = workers
+		self._running = 0
+
+	def submit(self, channel, job, callback):
+		"""
+		Run @job() in a worker thread and then @callback(result)
+		in the main loop, unless @channel is cancelled meanwhile
+		"""
+		with self._lock:
+			generation = self._generation[channel]
+			self._jobs.append((channel, generation, job, callback))
+			if self._running >= self._workers:
+				return
+			self._running += 1
+		thread = threading.Thread(target=self._run, name="IconLoader")
+		thread.setDaemon(True)
+		thread.start()
+
+	def cancel(self, channel):
+		"""Cancel all outstanding loads on @channel"""
+		with self._lock:
+			self._generation[channel] += 1
+			self._jobs = collections.deque(j for j in self._jobs
+			                               if j[0] is not channel)
+
+	def is_cancelled(self, channel, generation):
+		return self._generation[channel] != generation
+
+	def _run(self):
+		while True:
+			with self._lock:
+				if not self._jobs:
+					self._running -= 1
+					return
+				channel, generation, job, callback = self._jobs.popleft()
+			try:
+				result = job()
+			except Exception:
+				self.output_exc()
+				continue
+			gobject.idle_add(self._deliver, channel, generation, callback,
+					result)
+
+	def _deliver(self, channel, generation, callback, result):
+		if not self.is_cancelled(channel, generation):
+			callback(result)
+		return False
+
+def can_load_in_thread(leaf):
+	"""Return if the icon of @leaf can be looked up in a worker thread:
+	if it is a file whose icon is made by the methods of FileLeaf
+
+	>>> can_load_in_thread(FileLeaf("/tmp"))
+	True
+	>>> from kupfer.obj.objects import UrlLeaf
+	>>> can_load_in_thread(UrlLeaf("http://example.com/", u"Example"))
+	False
+	"""
+	leaf_type = type(leaf)
+	if not issubclass(leaf_type, FileLeaf):
+		return False
+	return all(getattr(leaf_type, name).im_func is
+	           getattr(FileLeaf, name).im_func
+	           for name in _FILE_ICON_METHODS)
+
+def lookup_icon(leaf, icon_size):
+	"""Look up the icon of @leaf, the part of get_pixbuf that may
+	access files; can run in any thread.
+
+	Return (thumbnail, gicon, icon name)
+	"""
+	thumbnail = leaf.get_thumbnail(icon_size, icon_size)
+	if thumbnail is not None:
+		return thumbnail, None, None
+	return None, leaf.get_gicon(), leaf.get_icon_name()
+
+def render_icon(leaf, icon_size, lookup):
+	"""Return the pixbuf for the result @lookup of lookup_icon,
+	in the main loop
+	"""
+	thumbnail, gicon, icon_name = lookup
+	if thumbnail is not None:
+		return thumbnail
+	pbuf = gicon and icons.get_icon_for_gicon(gicon, icon_size)
+	if not pbuf and icon_name:
+		pbuf = icons.get_icon_for_name(icon_name, icon_size)
+	return pbuf or icons.get_icon_for_name(leaf.fallback_icon_name, icon_size)
+
+_icon_loader = None
+def GetIconLoader():
+	global _icon_loader
+	if _icon_loader is None:
+		_icon_loader = IconLoader()
+	return _icon_loader
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
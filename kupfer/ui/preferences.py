@@ -407,8 +407,8 @@ class PreferencesWindowController (pretty.OutputMixin):
 		title_label = gtk.Label()
 		m_localized_name = gobject.markup_escape_text(info["localized_name"])
 		title_label.set_markup(u"<b><big>%s</big></b>" % m_localized_name)
-		version, description, author = plugins.get_plugin_attributes(plugin_id,
-				( "__version__", "__description__", "__author__", ))
+		version, description, author = \
+				info["version"], info["description"], info["author"]
 		about.pack_start(title_label, False)
 		infobox = gtk.VBox()
 		infobox.set_property("spacing", 3)
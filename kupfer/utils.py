@@ -3,7 +3,9 @@ import os
 from os import path as os_path
 import locale
 import signal
+import stat
 import sys
+import time
 
 import gobject
 import glib
@@ -19,6 +21,11 @@ from kupfer import terminal
 from kupfer.desktop_launch import SpawnError
 
 
+try:
+	from scandir import scandir
+except ImportError:
+	scandir = None
+
 def get_dirlist(folder, depth=0, include=None, exclude=None):
 	"""
 	Return a list of absolute paths in folder
@@ -26,39 +33,114 @@ def get_dirlist(folder, depth=0, include=None, exclude=None):
 	def include(filename):
 		return ShouldInclude
 	"""
-	from os import walk
-	paths = []
+	return list(iter_dirlist(folder, depth, include, exclude))
+
+def iter_dirlist(folder, depth=0, include=None, exclude=None,
+		listings=None, old_listings=None):
+	"""
+	Yield absolute paths in @folder and its subdirectories,
+	@depth levels down, in the order of os.walk: the directories and
+	then the files of each directory, before the contents of its
+	subdirectories. Links to directories are yielded with the
+	directories, but are not followed.
+
+	include, exclude: as for get_dirlist
+	@listings: a dict where each directory listing is recorded with the
+	modification time of the directory
+	@old_listings: the @listings of a previous scan; directories
+	not modified since are not listed again
+
+	>>> import shutil, tempfile
+	>>> root = tempfile.mkdtemp()
+	>>> os.mkdir(os_path.join(root, "dir"))
+	>>> open(os_path.join(root, "dir", "inner"), "w").close()
+	>>> open(os_path.join(root, "file"), "w").close()
+	>>> os.symlink(os_path.join(root, "dir"), os_path.join(root, "link"))
+	>>> paths = [p[len(root):] for p in iter_dirlist(root, depth=1)]
+	>>> sorted(paths[:2]), paths[2:]
+	(['/dir', '/link'], ['/file', '/dir/inner'])
+	>>> shutil.rmtree(root)
+	"""
 	def include_file(file):
 		return (not include or include(file)) and (not exclude or not exclude(file))
-		
-	for dirname, dirnames, fnames in walk(folder):
-		# skip deep directories
-		head, dp = dirname, 0
-		while not os_path.samefile(head, folder):
-			head, tail = os_path.split(head)
-			dp += 1
-		if dp > depth:
-			del dirnames[:]
+
+	pending = [(folder, 0)]
+	while pending:
+		dirname, level = pending.pop()
+		listing = _list_directory(dirname, listings, old_listings)
+		if listing is None:
 			continue
-		
-		excl_dir = []
+		dirnames, links, files = listing
+		subdirs = []
 		for dir in dirnames:
 			if not include_file(dir):
-				excl_dir.append(dir)
 				continue
 			abspath = os_path.join(dirname, dir)
-			paths.append(abspath)
-		
-		for file in fnames:
-			if not include_file(file):
-				continue
-			abspath = os_path.join(dirname, file)
-			paths.append(abspath)
-
-		for dir in reversed(excl_dir):
-			dirnames.remove(dir)
-
-	return paths
+			yield abspath
+			if level < depth and dir not in links:
+				subdirs.append((abspath, level + 1))
+		for file in files:
+			if include_file(file):
+				yield os_path.join(dirname, file)
+		pending.extend(reversed(subdirs))
+
+def _list_directory(dirname, listings, old_listings):
+	"""Return (directories, links, files) of @dirname: the names of
+	directories and links to directories, the names of the links among
+	them, and the names of everything else
+
+	Return None if @dirname can't be listed.
+	"""
+	try:
+		mtime = os.stat(dirname).st_mtime
+	except OSError:
+		return None
+	cached = old_listings and old_listings.get(dirname)
+	if cached and cached[0] == mtime:
+		if listings is not None:
+			listings[dirname] = cached
+		return cached[1:]
+	dirnames = []
+	links = []
+	files = []
+	try:
+		if scandir is not None:
+			for entry in scandir(dirname):
+				try:
+					is_dir = entry.is_dir()
+				except OSError:
+					is_dir = False
+				if not is_dir:
+					files.append(entry.name)
+					continue
+				dirnames.append(entry.name)
+				if entry.is_symlink():
+					links.append(entry.name)
+		else:
+			for name in os.listdir(dirname):
+				path = os_path.join(dirname, name)
+				try:
+					mode = os.lstat(path).st_mode
+					is_link = stat.S_ISLNK(mode)
+					if is_link:
+						mode = os.stat(path).st_mode
+				except OSError:
+					files.append(name)
+					continue
+				if not stat.S_ISDIR(mode):
+					files.append(name)
+					continue
+				dirnames.append(name)
+				if is_link:
+					links.append(name)
+	except OSError:
+		return None
+	listing = (tuple(dirnames), frozenset(links), tuple(files))
+	# A directory modified within the same second may change again
+	# without a new modification time
+	if listings is not None and time.time() - mtime > 1:
+		listings[dirname] = (mtime, ) + listing
+	return listing
 
 def locale_sort(seq, key=unicode):
 	"""Return @seq of objects with @key function as a list sorted